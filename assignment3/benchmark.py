@@ -0,0 +1,124 @@
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import create_engine
+
+import z5298989 as pipeline
+
+"""
+    Benchmarks for the z5298989 preprocessing pipeline
+
+    Usage: python benchmark.py stages [<input.csv>] [<results.json>]
+                Times every pipeline stage on the input and on synthetic copies scaled 10x and 100x,
+                default: validation.csv, benchmark_results.json
+           python benchmark.py workers [<input.csv>]
+                Compares the JSON normalization with 1, 2, 4 and 8 worker processes
+"""
+
+SCALE_FACTORS = (1, 10, 100)
+
+
+def benchmark_workers(input_csv, worker_counts=(1, 2, 4, 8)):
+    """ Times the JSON normalization for each worker count and checks the output against the serial path """
+    df = pd.read_csv(input_csv)
+    serial_dfs = pipeline.normalize_df(df)
+
+    results = []
+    for workers in worker_counts:
+        start = time.perf_counter()
+        child_dfs = pipeline.normalize_df_parallel(df, workers) if workers > 1 else pipeline.normalize_df(df)
+        elapsed = time.perf_counter() - start
+
+        for table_name, serial_df in serial_dfs.items():
+            pd.testing.assert_frame_equal(serial_df, child_dfs[table_name], check_dtype=False)
+
+        results.append({"workers": workers, "seconds": elapsed, "movies_per_sec": len(df) / elapsed})
+    return pd.DataFrame(results)
+
+
+def scale_dataset(input_csv, factor, output_csv, seed=0):
+    """ Writes factor copies of the input with new movie ids and budget/revenue/runtime perturbed by up to 5% """
+    df = pd.read_csv(input_csv)
+    rng = np.random.RandomState(seed)
+    id_offset = int(df["movie_id"].max()) + 1
+    copies = []
+    for copy_no in range(factor):
+        copy_df = df.copy()
+        copy_df["movie_id"] = copy_df["movie_id"] + copy_no * id_offset
+        if copy_no > 0:
+            for col in ["budget", "revenue", "runtime"]:
+                copy_df[col] = (copy_df[col] * rng.uniform(0.95, 1.05, len(copy_df))).round()
+        copies.append(copy_df)
+    pd.concat(copies, ignore_index=True).to_csv(output_csv, index=False)
+    return len(df) * factor
+
+
+def measure(results, dataset, stage, rows, func, *args, **kwargs):
+    # Times include the tracemalloc overhead, so only compare them with other runs of this harness
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    results.append({"dataset": dataset, "stage": stage, "rows": rows, "seconds": elapsed,
+                    "peak_memory_mb": peak / (1024 * 1024), "rows_per_sec": rows / elapsed if elapsed > 0 else None})
+    print("{:>14} {:>20} {:>8} rows {:>9.3f}s {:>9.1f} MB".format(
+        dataset, stage, rows, elapsed, peak / (1024 * 1024)))
+    return result
+
+
+def benchmark_stages(input_csv, work_dir, scale_factors=SCALE_FACTORS):
+    """ Runs csv_to_sqlite, the feature table build of pre_process, get_dataset, train_regression and
+    predict_regression on the input and its scaled copies. Runs inside work_dir, so the database, feature
+    store and model files of the pipeline are written there """
+    os.chdir(work_dir)
+    pipeline.engine = create_engine("sqlite:///" + os.path.join(work_dir, "benchmark.db"), echo=False)
+    results = []
+
+    for factor in scale_factors:
+        dataset = "{}x{}".format(os.path.basename(input_csv), factor)
+        scaled_csv = os.path.join(work_dir, "scaled_{}.csv".format(factor))
+        rows = scale_dataset(input_csv, factor, scaled_csv)
+
+        measure(results, dataset, "csv_to_sqlite", rows, pipeline.csv_to_sqlite, scaled_csv, "training_")
+        measure(results, dataset, "pre_process", rows, pipeline.build_feature_table, "training_")
+        measure(results, dataset, "get_dataset", rows, pipeline.get_dataset, "training_")
+        lin_reg = measure(results, dataset, "train_regression", rows,
+                          pipeline.train_regression, scaled_csv, do_preprocess=False)
+
+        # The prediction tables are set up outside of the measurement
+        pipeline.pre_process(scaled_csv, "predict_")
+        measure(results, dataset, "predict_regression", rows,
+                pipeline.predict_regression, lin_reg, scaled_csv, do_preprocess=False)
+        measure(results, dataset, "predict_csv", rows,
+                lambda: sum(len(batch) for batch in pipeline.predict_csv(scaled_csv)))
+    return results
+
+
+if __name__ == '__main__':
+    mode = sys.argv[1] if len(sys.argv) > 1 else "stages"
+    input_csv = os.path.abspath(sys.argv[2] if len(sys.argv) > 2 else "validation.csv")
+    pipeline.DEBUG = False
+
+    if mode == "workers":
+        print("Normalize " + input_csv)
+        print(benchmark_workers(input_csv).to_string(index=False))
+    else:
+        results_json = os.path.abspath(sys.argv[3] if len(sys.argv) > 3 else "benchmark_results.json")
+        cwd = os.getcwd()
+        with tempfile.TemporaryDirectory() as work_dir:
+            try:
+                stage_results = benchmark_stages(input_csv, work_dir)
+            finally:
+                os.chdir(cwd)
+        with open(results_json, "w") as f:
+            json.dump(stage_results, f, indent=2)
+        print("Results: " + results_json)
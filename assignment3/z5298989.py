@@ -1,4 +1,11 @@
 import sys
+import os
+import math
+import time
+import hashlib
+import pickle
+import itertools
+from concurrent.futures import ProcessPoolExecutor
 import pandas as pd
 import json
 import numpy as np
@@ -10,6 +17,12 @@ from sklearn.linear_model import LinearRegression
 from numpy import corrcoef
 from sklearn.metrics import explained_variance_score, mean_squared_error
 
+try:
+    # Optional: columnar feature store, get_dataset falls back to SQLite without it
+    import pyarrow.feather as feather
+except ImportError:
+    feather = None
+
 
 """
     Author: z529898
@@ -43,30 +56,20 @@ from sklearn.metrics import explained_variance_score, mean_squared_error
                                         ...
 """
 
-if len(sys.argv) != 3:
-    print("Usage:", sys.argv[0], "<training.csv> <validation.csv>")
-    sys.exit(1)
-
-try:
-    with open(sys.argv[1]) as f:
-        print("Training data: " + f.name)
-    with open(sys.argv[2]) as f:
-        print("Validation data: " + f.name)
-except IOError:
-    print("Input files do not exist!")
-    sys.exit(1)
-
-training_csv = sys.argv[1]
-validation_csv = sys.argv[2]
-
-print("Input done")
-
 engine = create_engine('sqlite:///./test', echo=False)
 pd.set_option('display.max_columns', None)
 pd.set_option('display.max_rows', None)
 pd.set_option('display.float_format', lambda x: '%.3f' % x)
 
 DEBUG = True
+# Rows per executemany batch of the bulk load in store_df
+SQLITE_BATCH_ROWS = 50000
+# Directory of the {prefix}movies.feather feature files
+FEATURE_STORE_DIR = "."
+# Trained regression model and its feature list, written by train_regression
+MODEL_PATH = "./z5298989.model.pkl"
+# Raw movie records scored per model call in predict_records
+PREDICT_BATCH_ROWS = 1000
 
 
 def log(s):
@@ -74,184 +77,451 @@ def log(s):
         print(s)
 
 
-def json_list_to_df(fk_name, fk_value, col_prefix, json_str):
-    json_list = json.loads(json_str)
-    if json_str is None or len(json_str) == 0:
-        return None
-    col_map = {}
+MOVIE_COLUMNS = ["movie_id", "budget", "homepage", "original_language", "original_title", "overview",
+                 "release_date", "revenue", "runtime", "status", "tagline", "rating"]
+
+# (CSV column, column prefix, table name, id column counted in pre_process) of the JSON list columns
+# normalized into child tables
+JSON_CHILD_TABLES = [
+    ("cast", "cast_", "cast", "cast_credit_id"),
+    ("crew", "crew_", "crew", "crew_credit_id"),
+    ("genres", "genres_", "genres", "genres_id"),
+    ("keywords", "keywords_", "keywords", "keywords_id"),
+    ("production_companies", "production_companies_", "prod_companies", "production_companies_id"),
+    ("production_countries", "production_countries_", "prod_countries", "production_countries_iso_3166_1"),
+    ("spoken_languages", "spoken_languages_", "languages", "spoken_languages_iso_639_1"),
+]
+
+
+def json_column_to_df(df, fk_name, json_col, col_prefix):
+    # Parse the whole column once and build the child table in a single DataFrame constructor call
+    # instead of concatenating one small frame per entry
+    records = []
+    for fk_value, json_str in zip(df[fk_name].values, df[json_col].values):
+        if not isinstance(json_str, str) or len(json_str) == 0:
+            continue
+        for entry in json.loads(json_str):
+            entry[fk_name] = fk_value
+            records.append(entry)
+    if len(records) == 0:
+        return pd.DataFrame(columns=[fk_name])
+
+    child_df = pd.DataFrame.from_records(records)
+    child_df.columns = [col if col == fk_name else col_prefix + col for col in child_df.columns]
+    # Keep the layout of the old per-row frames: prefixed entry columns first, foreign key last
+    return child_df[[col for col in child_df.columns if col != fk_name] + [fk_name]]
+
+
+def normalize_df(df):
+    """ Explodes all JSON list columns of the movie dataframe into their child tables (table name -> df) """
+    child_dfs = {}
+    for json_col, col_prefix, table_name, _ in JSON_CHILD_TABLES:
+        child_dfs[table_name] = json_column_to_df(df, "movie_id", json_col, col_prefix)
+    return child_dfs
+
+
+def normalize_df_parallel(df, workers, executor=None):
+    """ Same as normalize_df, but the frame is split into one chunk per worker and parsed in a process pool.
+    Callers normalizing several frames pass their executor, so the worker processes are started only once """
+    if len(df) == 0:
+        # Nothing to split (e.g. a header-only CSV)
+        return normalize_df(df)
+    if executor is None:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            return normalize_df_parallel(df, workers, executor)
+
+    json_cols = ["movie_id"] + [json_col for json_col, _, _, _ in JSON_CHILD_TABLES]
+    chunk_size = int(math.ceil(len(df) / workers))
+    chunks = [df[json_cols].iloc[i:i + chunk_size] for i in range(0, len(df), chunk_size)]
+    # map keeps the chunk order, so the merged tables have the same row order as the serial path
+    chunk_results = list(executor.map(normalize_df, chunks))
+
+    child_dfs = {}
+    for _, _, table_name, _ in JSON_CHILD_TABLES:
+        parts = [result[table_name] for result in chunk_results if len(result[table_name]) > 0]
+        child_dfs[table_name] = pd.concat(parts, ignore_index=True) if len(parts) > 0 \
+            else pd.DataFrame(columns=["movie_id"])
+    return child_dfs
+
+
+def store_df(p_df, table_name, if_exists='replace'):
+    """ Bulk loads a dataframe in one transaction and returns the elapsed seconds """
+    start = time.perf_counter()
+    with engine.begin() as connection:
+        # The tables are rebuilt from the CSV on failure anyway, no need for a durable journal during the load
+        connection.execute("PRAGMA journal_mode = MEMORY")
+        connection.execute("PRAGMA synchronous = OFF")
+        # No pandas index column: it would get its own index that has to be maintained on every insert
+        p_df.to_sql(table_name, con=connection, if_exists=if_exists, index=False, chunksize=SQLITE_BATCH_ROWS)
+    elapsed = time.perf_counter() - start
+    log("Stored Table: {} ({}) {} rows in {:.3f}s, {:.0f} rows/sec".format(
+        table_name, if_exists, len(p_df), elapsed, len(p_df) / elapsed if elapsed > 0 else 0))
+    return elapsed
+
+
+def create_indexes(table_prefix):
+    # Created after the load, so the inserts do not have to maintain them. The child table indexes cover
+    # (movie_id, counted id) so the pre_process aggregation never has to touch the table rows
+    with engine.begin() as connection:
+        connection.execute("CREATE INDEX IF NOT EXISTS ix_{0}movie_movie_id ON {0}movie (movie_id)"
+                           .format(table_prefix))
+        connection.execute("CREATE INDEX IF NOT EXISTS ix_{0}movie_hash_movie_id ON {0}movie_hash (movie_id)"
+                           .format(table_prefix))
+        for _, _, table_name, id_col in JSON_CHILD_TABLES:
+            connection.execute("CREATE INDEX IF NOT EXISTS ix_{0}{1}_movie_id ON {0}{1} (movie_id, {2})"
+                               .format(table_prefix, table_name, id_col))
+
+
+def read_csv_chunks(input_csv, chunk_size=None):
+    """ Yields (parsed chunk, content hash of each of its rows) of the input CSV, the whole file as one chunk
+    without a chunk_size """
+    # Every chunk is read once, as text: the hash is taken from the fields as written, whose dtypes do not
+    # depend on the other rows of the chunk, then the same frame is converted to the parsed form
+    text_options = {"dtype": str, "keep_default_na": False}
+    text_chunks = [pd.read_csv(input_csv, **text_options)] if chunk_size is None \
+        else pd.read_csv(input_csv, chunksize=chunk_size, **text_options)
+    for text_df in text_chunks:
+        row_hashes = pd.util.hash_pandas_object(text_df, index=False).astype(str).values
+        yield parse_text_df(text_df), row_hashes
+
+
+def parse_text_df(text_df):
+    """ Converts a frame read as text like read_csv would parse it: empty fields become NaN and columns that
+    hold only numbers become numeric. The strings are shared, not copied """
+    df = text_df.replace("", np.nan)
+    for col in df.columns:
+        df[col] = pd.to_numeric(df[col], errors="ignore")
+    return df
+
+
+def movie_hash_df(df, row_hashes):
+    # Content hash of every source row, used by the incremental refresh to find new and changed movies.
+    # Stored as text as the uint64 hashes do not fit into an SQLite INTEGER
+    return pd.DataFrame({"movie_id": df["movie_id"].values, "row_hash": row_hashes})
+
+
+def chunk_to_tables(df, row_hashes, workers=1, executor=None):
+    """ Builds all tables (table name -> df) stored for a chunk of the input CSV """
+    tables = {"movie": df.filter(MOVIE_COLUMNS), "movie_hash": movie_hash_df(df, row_hashes)}
+    tables.update(normalize_df_parallel(df, workers, executor) if workers > 1 else normalize_df(df))
+    return tables
+
+
+def worker_pool(workers):
+    """ Process pool shared by all chunks of a load, None for the serial path """
+    return ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+
+
+def delete_movies(table_prefix, movie_ids):
+    """ Removes the given movies from all tables and keeps their ids in {prefix}movie_changes """
+    store_df(pd.DataFrame({"movie_id": list(movie_ids)}), table_prefix + "movie_changes")
+    with engine.begin() as connection:
+        table_names = ["movie", "movie_hash", "movies"] + [table_name for _, _, table_name, _ in JSON_CHILD_TABLES]
+        for table_name in table_names:
+            connection.execute("DELETE FROM {0}{1} WHERE movie_id IN (SELECT movie_id FROM {0}movie_changes)"
+                               .format(table_prefix, table_name))
+
+
+def csv_to_sqlite(input_csv, table_prefix, workers=1, chunk_size=None):
+    # With a chunk_size the CSV is streamed: each chunk is normalized and appended to the tables before
+    # the next one is read, so memory is bounded by the chunk size instead of the file size
+    stored_tables = set()
+    store_stats = {}
+
+    executor = worker_pool(workers)
     try:
-        temp_df_cols = json_list[0].keys()
-        for col in temp_df_cols:
-            col_map.update({col: col_prefix + col})
-        col_map.update({fk_name: fk_name})
-
-        # print("Data: " + json_str)
-        # print("Columns: " + str(col_map))
-
-        ret_df = pd.DataFrame(columns=col_map.values())
-        for entry in json_list:
-            data_row = {fk_name: [fk_value]}
-            for key in entry:
-                data_row.update({col_map[key]: [entry[key]]})
-            temp_df = pd.DataFrame.from_dict(data_row, orient='columns')
-            ret_df = pd.concat([ret_df, temp_df])
-        return ret_df
-    except IndexError:
-        print("x")
-
-
-def store_df(p_df, table_name):
-    log("Storing Table: " + table_name)
-    p_df.to_sql(table_name, con=engine, if_exists='replace')
-
-
-def csv_to_sqlite(input_csv, table_prefix):
-    df = pd.read_csv(input_csv)
-    # print(df.head(1))
-    cast_df = pd.DataFrame()
-    crew_df = pd.DataFrame()
-    genres_df = pd.DataFrame()
-    keywords_df = pd.DataFrame()
-    prod_companies_df = pd.DataFrame()
-    prod_countries_df = pd.DataFrame()
-    languages_df = pd.DataFrame()
-
-    log("Normalize dataframe")
-    for index, row in df.iterrows():
-        print(".", end='')
-        tmp_cast_df = json_list_to_df("movie_id", row['movie_id'], "cast_", row["cast"])
-        tmp_crew_df = json_list_to_df("movie_id", row['movie_id'], "crew_", row["crew"])
-        tmp_genres_df = json_list_to_df("movie_id", row['movie_id'], "genres_", row["genres"])
-        tmp_keywords_df = json_list_to_df("movie_id", row['movie_id'], "keywords_", row["keywords"])
-        tmp_prod_companies_df = json_list_to_df("movie_id", row['movie_id'], "production_companies_",
-                                                       row["production_companies"])
-        tmp_prod_countries_df = json_list_to_df("movie_id", row['movie_id'], "production_countries_",
-                                                       row["production_countries"])
-        tmp_languages_df = json_list_to_df("movie_id", row['movie_id'], "spoken_languages_", row["spoken_languages"])
-
-        if tmp_cast_df is not None:
-            cast_df = pd.concat([cast_df, tmp_cast_df])
-        if tmp_crew_df is not None:
-            crew_df = pd.concat([crew_df, tmp_crew_df])
-        if tmp_genres_df is not None:
-            genres_df = pd.concat([genres_df, tmp_genres_df])
-        if tmp_keywords_df is not None:
-            keywords_df = pd.concat([keywords_df, tmp_keywords_df])
-        if tmp_prod_companies_df is not None:
-            prod_companies_df = pd.concat([prod_companies_df, tmp_prod_companies_df])
-        if tmp_prod_countries_df is not None:
-            prod_countries_df = pd.concat([prod_countries_df, tmp_prod_countries_df])
-        if tmp_languages_df is not None:
-            languages_df = pd.concat([languages_df, tmp_languages_df])
-
-    # test = json_list_to_df("movie_id", 19995, "cast_", df["cast"][0])
-    log("Store DataFrames")
-    df = df.filter(["movie_id","budget","homepage","original_language","original_title","overview","release_date","revenue","runtime","status","tagline","rating"])
-    store_df(df, table_prefix + "movie")
-    store_df(cast_df, table_prefix + "cast")
-    store_df(crew_df, table_prefix + "crew")
-    store_df(genres_df, table_prefix + "genres")
-    store_df(keywords_df, table_prefix + "keywords")
-    store_df(prod_companies_df, table_prefix + "prod_companies")
-    store_df(prod_countries_df, table_prefix + "prod_countries")
-    store_df(languages_df, table_prefix + "languages")
+        for chunk_no, (df, row_hashes) in enumerate(read_csv_chunks(input_csv, chunk_size)):
+            log("Normalize chunk " + str(chunk_no) + " (workers=" + str(workers) + ")")
+            tables = chunk_to_tables(df, row_hashes, workers, executor)
+
+            log("Store DataFrames")
+            for table_name, table_df in tables.items():
+                # An empty child frame has no entry columns yet, it must not define the table schema
+                if len(table_df) == 0:
+                    continue
+                elapsed = store_df(table_df, table_prefix + table_name,
+                                   'append' if table_name in stored_tables else 'replace')
+                stored_tables.add(table_name)
+                rows, seconds = store_stats.get(table_name, (0, 0.0))
+                store_stats[table_name] = (rows + len(table_df), seconds + elapsed)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    # Tables without any rows still need the columns pre_process reads
+    if "movie" not in stored_tables:
+        store_df(pd.DataFrame(columns=MOVIE_COLUMNS), table_prefix + "movie")
+        store_df(pd.DataFrame(columns=["movie_id", "row_hash"]), table_prefix + "movie_hash")
+    for _, _, table_name, id_col in JSON_CHILD_TABLES:
+        if table_name not in stored_tables:
+            store_df(pd.DataFrame(columns=[id_col, "movie_id"]), table_prefix + table_name)
+    create_indexes(table_prefix)
+
+    for table_name, (rows, seconds) in store_stats.items():
+        log("Store summary: {}{} {} rows, {:.0f} rows/sec".format(
+            table_prefix, table_name, rows, rows / seconds if seconds > 0 else 0))
     log("Store complete")
+    return store_stats
+
 
+def csv_to_sqlite_incremental(input_csv, table_prefix, workers=1, chunk_size=None):
+    """ Replaces only the rows of new, changed and removed movies. Returns their ids, which are also
+    left in {prefix}movie_changes """
+    stored_df = pd.read_sql_query("select movie_id, row_hash from {}movie_hash".format(table_prefix), con=engine)
+    stored_hashes = dict(zip(stored_df["movie_id"].values, stored_df["row_hash"].values))
 
-def pre_process(input_csv, table_prefix):
-    csv_to_sqlite(input_csv, table_prefix)
+    seen_ids = set()
+    changed_ids = []
+    executor = worker_pool(workers)
+    try:
+        for chunk_no, (df, row_hashes) in enumerate(read_csv_chunks(input_csv, chunk_size)):
+            hash_df = movie_hash_df(df, row_hashes)
+            seen_ids.update(hash_df["movie_id"].values)
+            is_changed = np.array([stored_hashes.get(movie_id) != row_hash for movie_id, row_hash
+                                   in zip(hash_df["movie_id"].values, hash_df["row_hash"].values)], dtype=bool)
+            df = df[is_changed]
+            row_hashes = row_hashes[is_changed]
+            log("Incremental chunk " + str(chunk_no) + ": " + str(len(df)) + " new or changed movies")
+            if len(df) == 0:
+                continue
+
+            delete_movies(table_prefix, df["movie_id"].values)
+            for table_name, table_df in chunk_to_tables(df, row_hashes, workers, executor).items():
+                if len(table_df) > 0:
+                    store_df(table_df, table_prefix + table_name, 'append')
+            changed_ids.extend(df["movie_id"].values)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    removed_ids = [movie_id for movie_id in stored_hashes if movie_id not in seen_ids]
+    log("Incremental: " + str(len(removed_ids)) + " removed movies")
+    delete_movies(table_prefix, removed_ids)
+    changed_ids.extend(removed_ids)
+    store_df(pd.DataFrame({"movie_id": changed_ids}), table_prefix + "movie_changes")
+    return changed_ids
+
+
+# Per movie features of the {0}movies table. {1} filters the child tables and {2} the movie table, both are
+# empty for a full build. All child tables are read in one UNION ALL scan (over their covering indexes) and
+# aggregated in a single GROUP BY, instead of one left join + group by per child table
+MOVIES_FEATURE_SQL = """
+with children as (
+    SELECT movie_id, 'cast' as kind, cast_credit_id as item FROM {0}cast {1}
+    UNION ALL
+    SELECT movie_id, 'crew', crew_credit_id FROM {0}crew {1}
+    UNION ALL
+    SELECT movie_id, 'genres', genres_id FROM {0}genres {1}
+    UNION ALL
+    SELECT movie_id, 'keywords', keywords_id FROM {0}keywords {1}
+    UNION ALL
+    SELECT movie_id, 'languages', spoken_languages_iso_639_1 FROM {0}languages {1}
+    UNION ALL
+    SELECT movie_id, 'prod_companies', production_companies_id FROM {0}prod_companies {1}
+    UNION ALL
+    SELECT movie_id, 'prod_countries', production_countries_iso_3166_1 FROM {0}prod_countries {1}
+), children_agg as (
+    SELECT movie_id
+         , count(case when kind = 'cast' then item end)                          as cast_cnt
+         , group_concat(distinct case when kind = 'cast' then item end)           as cast_list
+         , count(case when kind = 'crew' then item end)                          as crew_cnt
+         , group_concat(distinct case when kind = 'crew' then item end)           as crew_list
+         , count(case when kind = 'genres' then item end)                        as genres_cnt
+         , group_concat(distinct case when kind = 'genres' then item end)         as genre_list
+         , count(case when kind = 'keywords' then item end)                      as kw_cnt
+         , group_concat(distinct case when kind = 'keywords' then item end)       as keywords_list
+         , count(case when kind = 'languages' then item end)                     as languages_cnt
+         , group_concat(distinct case when kind = 'languages' then item end)      as languages_list
+         , count(case when kind = 'prod_companies' then item end)                as prod_companies_cnt
+         , group_concat(distinct case when kind = 'prod_companies' then item end) as prod_companies_list
+         , count(case when kind = 'prod_countries' then item end)                as prod_countries_cnt
+         , group_concat(distinct case when kind = 'prod_countries' then item end) as prod_countries_list
+    FROM children
+    group by movie_id
+)
+SELECT m.movie_id
+    ,m.revenue
+    ,m.budget
+    ,case when m.homepage is null then 0 else 1 end                 as has_homepage
+    ,length(m.original_title)                                        as title_len
+    ,length(m.overview)                                              as overview_len
+    ,cast(strftime('%m', date(m.release_date)) as int)               as release_month
+    ,cast(strftime('%Y', date(m.release_date)) as int)               as release_year
+    ,cast(strftime('%j', date(m.release_date)) as int)               as release_day_of_year
+    ,m.runtime
+    ,length(coalesce(m.tagline,''))                                  as tagline_len
+    ,coalesce(c.cast_cnt, 0)                                         as cast_cnt
+    ,coalesce(c.crew_cnt, 0)                                         as crew_cnt
+    ,coalesce(c.genres_cnt, 0)                                       as genres_cnt
+    ,coalesce(c.kw_cnt, 0)                                           as kw_cnt
+    ,coalesce(c.languages_cnt, 0)                                    as languages_cnt
+    ,coalesce(c.prod_companies_cnt, 0)                               as prod_companies_cnt
+    ,coalesce(c.prod_countries_cnt, 0)                               as prod_countries_cnt
+    ,m.homepage, m.original_language, m.original_title, m.overview, m.release_date,m.tagline
+    ,c.prod_countries_list
+    ,c.genre_list
+    ,c.languages_list
+    ,c.prod_companies_list
+    ,c.keywords_list
+    ,c.cast_list
+    ,c.crew_list
+from {0}movie m
+left join children_agg c on c.movie_id = m.movie_id
+{2}
+"""
+
+
+def pre_process(input_csv, table_prefix, workers=1, chunk_size=None, incremental=False):
+    if incremental and engine.has_table(table_prefix + "movies") and engine.has_table(table_prefix + "movie_hash"):
+        changed_ids = csv_to_sqlite_incremental(input_csv, table_prefix, workers, chunk_size)
+        with engine.begin() as connection:
+            # Deleted and changed movies were already removed by csv_to_sqlite_incremental
+            connection.execute("""INSERT INTO {0}movies """.format(table_prefix) + MOVIES_FEATURE_SQL.format(
+                table_prefix,
+                "WHERE movie_id IN (SELECT movie_id FROM {0}movie_changes)".format(table_prefix),
+                "WHERE m.movie_id IN (SELECT movie_id FROM {0}movie_changes)".format(table_prefix)))
+        log("Incremental refresh: {} movies updated".format(len(changed_ids)))
+        write_feature_store(table_prefix)
+        store_fingerprint(input_csv, table_prefix)
+        return
+
+    csv_to_sqlite(input_csv, table_prefix, workers, chunk_size)
+    build_feature_table(table_prefix)
+    store_fingerprint(input_csv, table_prefix)
+
+
+def build_feature_table(table_prefix):
+    """ Rebuilds {prefix}movies from the tables loaded by csv_to_sqlite and exports it to the feature store """
     with engine.begin() as connection:
         connection.execute("""DROP TABLE IF EXISTS {0}movies""".format(table_prefix))
-        connection.execute("""
-        create table {0}movies as
-        with base as (
-            SELECT m.movie_id
-                 , max(revenue) as revenue
-                 , max(budget) as budget
-                 , max(case when homepage is null then 0 else 1 end) as has_homepage
-                 --original_language,
-                 , max(length(original_title))                          title_len
-                 , max(length(overview)  )                              overview_len
-                 , max(cast(strftime('%m', date(release_date)) as int)) release_month
-                 , max(cast(strftime('%j', date(release_date)) as int)) release_day_of_year
-                 , max(cast(strftime('%Y',date(release_date)) as int)) release_year
-                 , max(revenue) as revenue
-                 , max(runtime) as runtime
-                 --status,
-                 , max(length(coalesce(tagline,'')))                            as tagline_len
-                 --rating
-                 , count(c.cast_credit_id)                      as cast_cnt
-                , group_concat(distinct c.cast_credit_id) as cast_list
-            FROM {0}movie m
-                     left join {0}cast c on c.movie_id = m.movie_id
-            group by m.movie_id
-        ), crew_cnt as (
-            SELECT m.movie_id, count(cw.crew_credit_id) as crew_cnt, group_concat(distinct crew_credit_id) as crew_list
-            FROM {0}movie m
-                left join {0}crew cw on cw.movie_id = m.movie_id
-            group by m.movie_id
-        ), genres_cnt as (
-            SELECT m.movie_id, count(cw.genres_id) as genres_cnt, group_concat(distinct genres_id) as genre_list
-            FROM {0}movie m
-                left join {0}genres cw on cw.movie_id = m.movie_id
-            group by m.movie_id
-        ), kw_cnt as (
-            SELECT m.movie_id, count(cw.keywords_id) as kw_cnt, group_concat(distinct keywords_id) as keywords_list
-            FROM {0}movie m
-                left join {0}keywords cw on cw.movie_id = m.movie_id
-            group by m.movie_id
-        ), languages_cnt as (
-            SELECT m.movie_id, count(cw.spoken_languages_iso_639_1) as languages_cnt, group_concat(distinct spoken_languages_iso_639_1) as languages_list
-            FROM {0}movie m
-                left join {0}languages cw on cw.movie_id = m.movie_id
-            group by m.movie_id
-        ), prod_companies_cnt as (
-            SELECT m.movie_id, count(cw.production_companies_id) as prod_companies_cnt, group_concat(distinct cw.production_companies_id) as prod_companies_list
-            FROM {0}movie m
-                left join {0}prod_companies cw on cw.movie_id = m.movie_id
-            group by m.movie_id
-        ), prod_countries_cnt as (
-            SELECT m.movie_id, count(cw.production_countries_iso_3166_1) as prod_countries_cnt, group_concat(distinct cw.production_countries_iso_3166_1) as prod_countries_list
-            FROM {0}movie m
-                left join {0}prod_countries cw on cw.movie_id = m.movie_id
-            group by m.movie_id
-        )
-        SELECT base.movie_id
-            ,base.revenue
-            ,base.budget
-            ,has_homepage
-            ,title_len
-            ,overview_len
-            ,release_month,release_year,release_day_of_year
-            ,base.runtime
-            ,tagline_len
-            ,cast_cnt
-            ,crew_cnt
-            ,genres_cnt
-            ,kw_cnt
-            ,languages_cnt
-            ,prod_companies_cnt
-            ,prod_countries_cnt
-            ,m.homepage, m.original_language, m.original_title, m.overview, m.release_date,m.tagline
-            ,prod_countries_list
-            ,genre_list
-            ,languages_list
-            ,prod_companies_list
-            ,keywords_list
-            ,base.cast_list
-            ,crew_cnt.crew_list
-        from base
-        join {0}movie m on m.movie_id = base.movie_id
-        join crew_cnt on base.movie_id = crew_cnt.movie_id
-        join genres_cnt on base.movie_id  = genres_cnt.movie_id
-        join kw_cnt on base.movie_id  = kw_cnt.movie_id
-        join languages_cnt on base.movie_id  = languages_cnt.movie_id
-        join prod_companies_cnt on base.movie_id  = prod_companies_cnt.movie_id
-        join prod_countries_cnt on base.movie_id  = prod_countries_cnt.movie_id
-        """.format(table_prefix))
+        connection.execute("""create table {0}movies as """.format(table_prefix)
+                           + MOVIES_FEATURE_SQL.format(table_prefix, "", ""))
+        connection.execute("""CREATE INDEX IF NOT EXISTS ix_{0}movies_movie_id ON {0}movies (movie_id)"""
+                           .format(table_prefix))
+    write_feature_store(table_prefix)
+
+
+def file_content_hash(input_csv):
+    sha256 = hashlib.sha256()
+    with open(input_csv, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            sha256.update(block)
+    return sha256.hexdigest()
+
+
+def setup_fingerprint_table():
+    with engine.begin() as connection:
+        connection.execute(""" CREATE TABLE IF NOT EXISTS preprocess_fingerprint (
+                                    table_prefix TEXT PRIMARY KEY,
+                                    input_csv TEXT,
+                                    size INTEGER,
+                                    mtime REAL,
+                                    content_hash TEXT
+                                ) """)
+
+
+def store_fingerprint(input_csv, table_prefix, content_hash=None):
+    """ Remembers which input the {prefix} tables were built from """
+    setup_fingerprint_table()
+    stat = os.stat(input_csv)
+    content_hash = file_content_hash(input_csv) if content_hash is None else content_hash
+    with engine.begin() as connection:
+        connection.execute(""" INSERT OR REPLACE INTO preprocess_fingerprint
+                                (table_prefix, input_csv, size, mtime, content_hash) VALUES(?,?,?,?,?)""",
+                           (table_prefix, os.path.abspath(input_csv), stat.st_size, stat.st_mtime, content_hash))
+
+
+def is_preprocessed(input_csv, table_prefix):
+    """ True if the {prefix} feature table was built from the unchanged input_csv """
+    if not engine.has_table(table_prefix + "movies"):
+        return False
+    setup_fingerprint_table()
+    with engine.connect() as connection:
+        fingerprint = connection.execute(""" SELECT input_csv, size, mtime, content_hash FROM preprocess_fingerprint
+                                             WHERE table_prefix = ?""", (table_prefix,)).fetchone()
+    if fingerprint is None:
+        return False
+
+    stat = os.stat(input_csv)
+    if stat.st_size != fingerprint["size"]:
+        return False
+    # Same file, size and mtime: trust it without reading it, so an unchanged input costs one stat call.
+    # Another file may share size and mtime (e.g. extracted from the same archive), its content decides
+    if os.path.abspath(input_csv) == fingerprint["input_csv"] and stat.st_mtime == fingerprint["mtime"]:
+        return True
+    # Touched or another file, but maybe the same content: compare it and remember the new path and mtime
+    content_hash = file_content_hash(input_csv)
+    if content_hash != fingerprint["content_hash"]:
+        return False
+    store_fingerprint(input_csv, table_prefix, content_hash)
+    return True
+
+
+def cached_pre_process(input_csv, table_prefix, workers=1, chunk_size=None, incremental=False):
+    if is_preprocessed(input_csv, table_prefix):
+        log("Input unchanged, reusing {}movies".format(table_prefix))
+        return
+    pre_process(input_csv, table_prefix, workers, chunk_size, incremental)
+
+
+# Compact dtypes of the numeric {prefix}movies columns in the feature store
+FEATURE_DTYPES = {
+    "movie_id": "int64",
+    "revenue": "int64",
+    "budget": "int64",
+    "has_homepage": "int8",
+    "title_len": "int32",
+    "overview_len": "int32",
+    "release_month": "int16",
+    "release_year": "int16",
+    "release_day_of_year": "int16",
+    "runtime": "float32",
+    "tagline_len": "int32",
+    "cast_cnt": "int32",
+    "crew_cnt": "int32",
+    "genres_cnt": "int32",
+    "kw_cnt": "int32",
+    "languages_cnt": "int32",
+    "prod_companies_cnt": "int32",
+    "prod_countries_cnt": "int32",
+}
+
+# Columns returned by get_dataset, same as its SQL query
+DATASET_COLUMNS = ["revenue", "budget", "release_month", "release_year", "release_day_of_year", "runtime",
+                   "tagline_len", "cast_cnt", "crew_cnt", "genres_cnt", "kw_cnt", "prod_companies_cnt"]
+
+
+def feature_store_path(table_prefix):
+    return os.path.join(FEATURE_STORE_DIR, table_prefix + "movies.feather")
+
+
+def write_feature_store(table_prefix):
+    """ Exports the numeric columns of {prefix}movies to an uncompressed feather file that get_dataset
+    can memory-map """
+    path = feature_store_path(table_prefix)
+    if feather is None:
+        # An old file would no longer match the table
+        if os.path.exists(path):
+            os.remove(path)
+        return
+
+    df = pd.read_sql_query("select {} from {}movies".format(", ".join(FEATURE_DTYPES), table_prefix), con=engine)
+    for col, dtype in FEATURE_DTYPES.items():
+        # Integer columns with missing values (e.g. no release_date) have to stay floating point
+        if dtype.startswith("int") and df[col].isnull().any():
+            dtype = "float32" if dtype in ("int8", "int16") else "float64"
+        df[col] = df[col].astype(dtype)
+    feather.write_feather(df, path, compression="uncompressed")
+    log("Feature store: " + path)
 
 
 def get_dataset(table_prefix):
+    path = feature_store_path(table_prefix)
+    if feather is not None and os.path.exists(path):
+        # Memory-mapped, the numeric columns are not copied through Python objects like in read_sql_query
+        df = feather.read_table(path, columns=DATASET_COLUMNS, memory_map=True).to_pandas(split_blocks=True)
+        return df[df["revenue"] > 10000].reset_index(drop=True)
+
     return pd.read_sql_query("""select  revenue,
                                         budget,
                                         --has_homepage,
@@ -274,10 +544,14 @@ def get_dataset(table_prefix):
                                         """.format(table_prefix),con=engine)
 
 
-def train_regression(input_csv, do_preprocess=True):
+def train_regression(input_csv, do_preprocess=None, workers=1, chunk_size=None,
+                     incremental=False):
     tbl_prefix = "training_"
-    if do_preprocess:
-        pre_process(input_csv, tbl_prefix)
+    # None: rebuild only if the input changed since the last pre_process
+    if do_preprocess is None:
+        cached_pre_process(input_csv, tbl_prefix, workers, chunk_size, incremental)
+    elif do_preprocess:
+        pre_process(input_csv, tbl_prefix, workers, chunk_size, incremental)
 
     dataset = get_dataset(tbl_prefix)
 
@@ -291,13 +565,18 @@ def train_regression(input_csv, do_preprocess=True):
     lin_reg.fit(features, target)
 
     log(pd.DataFrame({'features': features.columns, 'coefficients': lin_reg.coef_[0]}))
+    save_model(lin_reg, list(features.columns))
     return lin_reg
 
 
-def predict_regression(lin_reg, input_csv, do_preprocess=True):
+def predict_regression(lin_reg, input_csv, do_preprocess=None, workers=1, chunk_size=None,
+                       incremental=False):
     tbl_prefix = "predict_"
-    if do_preprocess:
-        pre_process(input_csv, tbl_prefix)
+    # None: rebuild only if the input changed since the last pre_process
+    if do_preprocess is None:
+        cached_pre_process(input_csv, tbl_prefix, workers, chunk_size, incremental)
+    elif do_preprocess:
+        pre_process(input_csv, tbl_prefix, workers, chunk_size, incremental)
 
     dataset = get_dataset(tbl_prefix)
     target = dataset.loc[:, dataset.columns == 'revenue']  # dependent, y
@@ -306,23 +585,113 @@ def predict_regression(lin_reg, input_csv, do_preprocess=True):
     log(dataset.describe())
     log(pd.DataFrame({'features': features.columns, 'coefficients': lin_reg.coef_[0]}))
 
-    prediction = reg.predict(features)
+    prediction = lin_reg.predict(features)
     target.insert(1, "predicted", prediction, True)
     log(target.head())
     return target
 
 
-print("Training")
-reg = train_regression(training_csv, do_preprocess=False)
-print("Prediction")
-predicted_data = predict_regression(reg, validation_csv, do_preprocess=False)
+def save_model(lin_reg, feature_names, path=MODEL_PATH):
+    with open(path, "wb") as f:
+        pickle.dump({"model": lin_reg, "features": feature_names}, f)
+    log("Model saved: " + path)
+
+
+def load_model(path=MODEL_PATH):
+    """ Returns the model and the feature list it was trained on """
+    with open(path, "rb") as f:
+        stored = pickle.load(f)
+    return stored["model"], stored["features"]
+
+
+def text_len(series):
+    # NaN for missing text like length(NULL) in SQL. Not .str.len(): a batch without any text has a float column
+    return series.map(lambda text: len(text) if isinstance(text, str) else np.nan)
+
+
+def compute_features(df):
+    """ Computes the {prefix}movies feature columns of MOVIES_FEATURE_SQL directly from raw movie records """
+    features = pd.DataFrame({"movie_id": df["movie_id"].values})
+    features["revenue"] = df["revenue"].values if "revenue" in df.columns else np.nan
+    features["budget"] = df["budget"].values
+    features["has_homepage"] = df["homepage"].notnull().astype("int8").values
+    features["title_len"] = text_len(df["original_title"]).values
+    features["overview_len"] = text_len(df["overview"]).values
+    release_date = pd.to_datetime(df["release_date"], errors="coerce")
+    features["release_month"] = release_date.dt.month.values
+    features["release_year"] = release_date.dt.year.values
+    features["release_day_of_year"] = release_date.dt.dayofyear.values
+    features["runtime"] = df["runtime"].values
+    features["tagline_len"] = df["tagline"].fillna("").str.len().values
+
+    # Same as count(<id column>) over the child table rows of a movie
+    cnt_names = {"cast": "cast_cnt", "crew": "crew_cnt", "genres": "genres_cnt", "keywords": "kw_cnt",
+                 "languages": "languages_cnt", "prod_companies": "prod_companies_cnt",
+                 "prod_countries": "prod_countries_cnt"}
+    for json_col, col_prefix, table_name, id_col in JSON_CHILD_TABLES:
+        key = id_col[len(col_prefix):]
+        features[cnt_names[table_name]] = df[json_col].map(
+            lambda json_str: sum(1 for entry in json.loads(json_str) if entry.get(key) is not None)
+            if isinstance(json_str, str) and len(json_str) > 0 else 0).values
+    return features
+
+
+def predict_df(lin_reg, feature_names, df):
+    """ Scores a dataframe of raw movie records, returns (movie_id, predicted_revenue) """
+    features = compute_features(df)
+    prediction = lin_reg.predict(features[feature_names])
+    return pd.DataFrame({"movie_id": features["movie_id"].values, "predicted_revenue": prediction.ravel()})
+
+
+def predict_records(records, model_path=MODEL_PATH, batch_size=PREDICT_BATCH_ROWS):
+    """ Scores a stream of raw movie records (dicts with the CSV columns) without SQLite.
+    Yields a dataframe (movie_id, predicted_revenue) per batch """
+    lin_reg, feature_names = load_model(model_path)
+    records = iter(records)
+    while True:
+        batch = list(itertools.islice(records, batch_size))
+        if len(batch) == 0:
+            return
+        yield predict_df(lin_reg, feature_names, pd.DataFrame.from_records(batch))
+
+
+def predict_csv(input_csv, model_path=MODEL_PATH, batch_size=PREDICT_BATCH_ROWS):
+    """ Scores a raw movie CSV batch by batch, like predict_records """
+    lin_reg, feature_names = load_model(model_path)
+    for df in pd.read_csv(input_csv, chunksize=batch_size):
+        yield predict_df(lin_reg, feature_names, df)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 3:
+        print("Usage:", sys.argv[0], "<training.csv> <validation.csv>")
+        sys.exit(1)
 
-print(predicted_data.describe())
-plt.scatter(predicted_data["predicted"].values, predicted_data["revenue"].values, color = 'blue')
-plt.title('Revenue vs Predicted Revenue')
-plt.xlabel('Actual Revenue')
-plt.ylabel('Predicted Revenue')
-plt.show()
+    try:
+        with open(sys.argv[1]) as f:
+            print("Training data: " + f.name)
+        with open(sys.argv[2]) as f:
+            print("Validation data: " + f.name)
+    except IOError:
+        print("Input files do not exist!")
+        sys.exit(1)
+
+    training_csv = sys.argv[1]
+    validation_csv = sys.argv[2]
+
+    print("Input done")
+
+    print("Training")
+    reg = train_regression(training_csv)
+    print("Prediction")
+    predicted_data = predict_regression(reg, validation_csv)
+
+    print(predicted_data.describe())
+    plt.scatter(predicted_data["predicted"].values, predicted_data["revenue"].values, color = 'blue')
+    plt.title('Revenue vs Predicted Revenue')
+    plt.xlabel('Actual Revenue')
+    plt.ylabel('Predicted Revenue')
+    plt.show()
 
 #predict_regression(reg)
 
@@ -0,0 +1,188 @@
+import json
+import os
+import sys
+import tempfile
+import time
+import timeit
+import tracemalloc
+
+import pandas as pd
+
+import z5298989 as service
+from stub_api import StubAPIServer
+
+"""
+    Latency benchmarks for the z5298989 data service
+
+    Usage: python benchmark.py [<indicator.json>]   (default: NY.GDP.MKTP.CD.json)
+    The collection is imported from a saved World Bank API page into a temporary database, and upstream
+    downloads are served by the local stub_api.StubAPIServer. No requests are sent to api.worldbank.org
+"""
+
+REPEAT = 5
+NUMBER = 200
+STUB_DELAY_SECONDS = 0.05  # Simulated upstream latency per request
+STUB_PAGE_SIZE = 50
+
+
+def import_from_file(db, indicator_json):
+    """ Stores a saved World Bank API page like Collections.post does and returns the collection id """
+    with open(indicator_json) as f:
+        records = json.load(f)[1]
+    indicator = records[0]["indicator"]
+    df = service.DataTransUtils.flatten_collections_df(pd.DataFrame(records))
+    return db.store_collection({"id": indicator["id"], "name": indicator["value"]},
+                               service.query_year_start, service.query_year_end, df)
+
+
+def collection_df(db, collection_id):
+    """ All observations of a collection with their country decoded, as the service read them before the
+    indexed queries """
+    with db.engine.connect() as connection:
+        return pd.read_sql_query('''
+            select c.name as country_value, o.year, o.value
+            from observations o join countries c on c.id = o.country_key
+            where o.collection_id = ?
+            order by o.rowid''', con=connection, params=[collection_id])
+
+
+def old_point_lookup(db, collection_id, year, country):
+    # Lookup as done before the indexed query: whole collection into pandas, then filter
+    result_df = collection_df(db, collection_id)
+    result_df = result_df[result_df["year"] == year]
+    result_df = result_df[result_df["country_value"] == country]
+    return result_df["value"].max()
+
+
+def new_point_lookup(db, collection_id, year, country):
+    return db.get_collection_value(collection_id, year, country)["value"]
+
+
+def report(name, timer):
+    best = min(timer.repeat(repeat=REPEAT, number=NUMBER)) / NUMBER
+    print("{:<40} {:>10.3f} ms".format(name, best * 1000))
+
+
+def benchmark_point_lookup(db, client, collection_id, year, country):
+    print("GET /collections/{}/{}/{}".format(collection_id, year, country))
+    report("old: DataFrame + pandas filter", timeit.Timer(lambda: old_point_lookup(db, collection_id, year, country)))
+    report("new: indexed query", timeit.Timer(lambda: new_point_lookup(db, collection_id, year, country)))
+    url = "/collections/{}/{}/{}".format(collection_id, year, country)
+    report("new: endpoint", timeit.Timer(lambda: client.get(url)))
+
+
+def read_collection(client, collection_id, url, stream):
+    service.collection_cache.invalidate(collection_id)
+    response = client.get(url, buffered=not stream)
+    size = sum(len(chunk) for chunk in response.response) if stream else len(response.get_data())
+    response.close()
+    return size
+
+
+def benchmark_collection_get(client, collection_id):
+    """ Time and peak memory of GET /collections/<id> without and with streaming """
+    print("GET /collections/{} (uncached)".format(collection_id))
+    for name, stream in (("in memory", False), ("stream=true", True)):
+        url = "/collections/{}{}".format(collection_id, "?stream=true" if stream else "")
+        tracemalloc.start()
+        start = time.perf_counter()
+        size = read_collection(client, collection_id, url, stream)
+        elapsed = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print("{:<40} {:>10.3f} ms {:>9.1f} KB peak {:>9} bytes".format(name, elapsed * 1000, peak / 1024, size))
+
+
+def benchmark_page_download(stub, indicator, concurrency_levels=(1, 2, 4, 8)):
+    """ Downloads all pages of the indicator from the stub with different numbers of parallel page requests """
+    service.api_base_url = stub.base_url
+    service.api_page_size = STUB_PAGE_SIZE
+    # Measure the fetching, not the rate limit or the response cache
+    service.api_rate_limiter = service.TokenBucket(1000, 1000)
+    service.api_cache_enabled = False
+
+    print("Download {} in pages of {}, {:.0f} ms per request".format(
+        indicator, STUB_PAGE_SIZE, STUB_DELAY_SECONDS * 1000))
+    reference = None
+    for concurrency in concurrency_levels:
+        service.api_max_concurrent_pages = concurrency
+        stub.reset_requests()
+        start = time.perf_counter()
+        data = service.APIService().get_all_by_indicator_and_date(indicator, service.query_year_start,
+                                                                   service.query_year_end)
+        elapsed = time.perf_counter() - start
+        reference = data if reference is None else reference
+        assert data == reference, "Page order differs from the sequential download"
+        print("{:<40} {:>10.3f} s {:>5} requests".format(
+            "{} concurrent page(s)".format(concurrency), elapsed, len(stub.requests)))
+
+
+def benchmark_import(stub, client, indicator):
+    """ Full POST /collections imports from the stub, with a new connection per request and with keep-alive """
+    service.api_base_url = stub.base_url
+    service.api_page_size = STUB_PAGE_SIZE
+    service.api_rate_limiter = service.TokenBucket(1000, 1000)
+    service.api_cache_enabled = False
+
+    print("POST /collections?indicator_id=" + indicator)
+    for keep_alive in (False, True):
+        service.api_session = service.HTTPSession(service.api_max_concurrent_pages, service.api_timeout_seconds,
+                                                  keep_alive=keep_alive)
+        stub.reset_requests()
+        start = time.perf_counter()
+        response = client.post("/collections?indicator_id=" + indicator)
+        elapsed = time.perf_counter() - start
+        print("{:<40} {:>10.3f} s {:>5} requests {:>5} connections".format(
+            "keep-alive" if keep_alive else "connection per request", elapsed, len(stub.requests),
+            stub.connections))
+        client.delete("/collections/{}".format(response.get_json()["id"]))
+
+
+def benchmark_cached_import(stub, client, indicator):
+    """ POST /collections imports through the response cache: cold, fresh, revalidated after the TTL and offline """
+    service.api_base_url = stub.base_url
+    service.api_page_size = STUB_PAGE_SIZE
+    service.api_rate_limiter = service.TokenBucket(1000, 1000)
+    service.api_session = service.HTTPSession(service.api_max_concurrent_pages, service.api_timeout_seconds)
+    service.api_cache_enabled = True
+    service.api_cache_dir = os.path.join(os.getcwd(), "api_cache")
+
+    print("POST /collections?indicator_id={} with response cache".format(indicator))
+    for run, ttl, offline in (("cold cache", 3600, False), ("fresh cache", 3600, False),
+                              ("stale cache, revalidated", 0, False), ("offline", 0, True)):
+        service.api_cache_ttl_seconds = ttl
+        service.api_cache_offline = offline
+        stub.reset_requests()
+        start = time.perf_counter()
+        response = client.post("/collections?indicator_id=" + indicator)
+        elapsed = time.perf_counter() - start
+        print("{:<40} {:>10.3f} s {:>5} requests".format(run, elapsed, len(stub.requests)))
+        client.delete("/collections/{}".format(response.get_json()["id"]))
+    service.api_cache_offline = False
+
+
+if __name__ == '__main__':
+    indicator_json = os.path.abspath(sys.argv[1] if len(sys.argv) > 1 else "NY.GDP.MKTP.CD.json")
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as work_dir:
+        # DBService creates its database relative to the working directory
+        os.chdir(work_dir)
+        try:
+            service_db = service.DBService.get_instance()
+            service_collection_id = import_from_file(service_db, indicator_json)
+            with service.app.test_client() as service_client:
+                benchmark_point_lookup(service_db, service_client, service_collection_id, 2015, "Australia")
+                benchmark_collection_get(service_client, service_collection_id)
+
+            stub_server = StubAPIServer(data_dir=os.path.dirname(indicator_json),
+                                        delay_seconds=STUB_DELAY_SECONDS).start()
+            stub_indicator = os.path.basename(indicator_json)[:-len(".json")]
+            benchmark_page_download(stub_server, stub_indicator)
+            # The point lookup collection occupies the indicator, import it again from scratch
+            with service.app.test_client() as service_client:
+                service_client.delete("/collections/{}".format(service_collection_id))
+                benchmark_import(stub_server, service_client, stub_indicator)
+                benchmark_cached_import(stub_server, service_client, stub_indicator)
+            stub_server.shutdown()
+        finally:
+            os.chdir(cwd)
@@ -0,0 +1,135 @@
+import gzip
+import hashlib
+import json
+import math
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+"""
+    Local stand-in for the World Bank API v2, serving canned indicator pages such as NY.GDP.MKTP.CD.json
+
+    Usage: python stub_api.py [<port>]     then set api_base_url = "http://localhost:<port>/v2"
+
+    Every <indicator>.json file of the data directory is a saved API response ([metadata, records]).
+    Its records are paginated again according to the per_page and page parameters of each request.
+"""
+
+INVALID_INDICATOR = [{"message": [{"id": "120", "key": "Invalid value",
+                                   "value": "The provided parameter value is not valid"}]}]
+
+
+class StubAPIHandler(BaseHTTPRequestHandler):
+    # Keep-alive like the real API. Headers and body are sent separately, without TCP_NODELAY every reused
+    # connection would wait for a delayed ACK
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        super().setup()
+        self.server.count_connection()
+
+    def do_GET(self):
+        server: StubAPIServer = self.server
+        server.count_request(self.path)
+        if server.delay_seconds > 0:
+            time.sleep(server.delay_seconds)
+
+        url = urlparse(self.path)
+        params = parse_qs(url.query)
+        parts = url.path.strip("/").split("/")
+        if parts[:2] == ["v2", "indicator"] and len(parts) == 3:
+            body = self.indicator_metadata(parts[2])
+        elif parts[:4] == ["v2", "countries", "all", "indicators"] and len(parts) == 5:
+            body = self.indicator_page(parts[4], int(params.get("per_page", ["50"])[0]),
+                                       int(params.get("page", ["1"])[0]))
+        else:
+            self.send_error(404)
+            return
+
+        content = json.dumps(body).encode("utf-8")
+        etag = '"' + hashlib.sha256(content).hexdigest()[:16] + '"'
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json;charset=utf-8")
+        self.send_header("ETag", etag)
+        if "gzip" in self.headers.get("Accept-Encoding", ""):
+            content = gzip.compress(content)
+            self.send_header("Content-Encoding", "gzip")
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def load_records(self, indicator):
+        path = os.path.join(self.server.data_dir, indicator + ".json")
+        if not os.path.exists(path):
+            return None
+        with open(path) as f:
+            return json.load(f)[1]
+
+    def indicator_metadata(self, indicator):
+        records = self.load_records(indicator)
+        if records is None:
+            return INVALID_INDICATOR
+        return [{"page": 1, "pages": 1, "per_page": "50", "total": 1},
+                [{"id": indicator, "name": records[0]["indicator"]["value"]}]]
+
+    def indicator_page(self, indicator, per_page, page):
+        records = self.load_records(indicator)
+        if records is None:
+            return INVALID_INDICATOR
+        pages = max(1, int(math.ceil(len(records) / per_page)))
+        page_records = records[(page - 1) * per_page:page * per_page]
+        return [{"page": page, "pages": pages, "per_page": per_page, "total": len(records)},
+                page_records if len(page_records) > 0 else None]
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StubAPIServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, port=0, data_dir=".", delay_seconds=0.0):
+        super().__init__(("localhost", port), StubAPIHandler)
+        self.data_dir = data_dir
+        self.delay_seconds = delay_seconds  # Simulated upstream latency per request
+        self.requests = []
+        self.connections = 0
+        self.lock = threading.Lock()
+
+    def count_request(self, path):
+        with self.lock:
+            self.requests.append(path)
+
+    def count_connection(self):
+        with self.lock:
+            self.connections += 1
+
+    def reset_requests(self):
+        with self.lock:
+            self.requests = []
+            self.connections = 0
+
+    @property
+    def base_url(self):
+        return "http://localhost:{}/v2".format(self.server_address[1])
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+
+if __name__ == '__main__':
+    stub = StubAPIServer(int(sys.argv[1]) if len(sys.argv) > 1 else 8000)
+    print("Serving canned World Bank pages on " + stub.base_url)
+    stub.serve_forever()
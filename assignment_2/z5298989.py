@@ -1,10 +1,22 @@
+import base64
+import gzip
+import hashlib
+import http.client
 import json
+import math
+import os
+import queue
 import re
+import threading
 import time
-from urllib.request import urlopen
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from urllib.error import HTTPError
+from urllib.parse import urlencode, urljoin, urlsplit
 
+import numpy as np
 import pandas as pd
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify
 from flask_restplus import Resource, Api, fields
 from sqlalchemy import create_engine
 
@@ -40,10 +52,30 @@ api = Api(app=app,
           default_mediatype="application/json")
 
 api_base_url = "http://api.worldbank.org/v2"
-api_sleep_seconds = 1  # Sleep to avoid hitting rate limit while iterating pages
+api_page_size = 10000
+api_max_concurrent_pages = 4  # Pages of one import fetched in parallel
+api_requests_per_second = 1  # Token bucket rate to avoid hitting the rate limit while fetching pages
+api_request_burst = 4  # Requests allowed at once before the rate applies
+api_timeout_seconds = 30
+api_cache_enabled = True  # On-disk cache of source API responses, keyed by the full request URL
+api_cache_dir = "./api_cache"
+api_cache_ttl_seconds = 24 * 60 * 60  # Older responses are revalidated with ETag/Last-Modified
+api_cache_offline = False  # Serve only from the cache, never contact the source API
+api_cache_seed_files = []  # Saved responses like NY.GDP.MKTP.CD.json loaded into the cache on startup
+import_max_workers = 2  # Background imports running at the same time (POST /collections?async=true)
+batch_max_indicators = 100  # Indicators per POST /collections/batch
+batch_max_concurrent_indicators = 4  # Indicators of a batch downloaded in parallel
+collections_max_page_size = 1000  # limit of GET /collections
+collection_order_columns = ["id", "creation_time", "indicator_id"]  # Columns GET /collections may be sorted by
+panel_max_collections = 10  # Collections side by side in one GET /collections/panel
 database_name = "z5298989.db"
 query_year_start = 2012
 query_year_end = 2017
+response_cache_max_entries = 128  # Collections kept ready-to-serve by GET /collections/<id>
+response_cache_max_bytes = 64 * 1024 * 1024  # Upper bound of their serialized size
+stats_cache_max_entries = 1024  # Results of GET /collections/<id>/stats kept until their collection is deleted
+stats_max_percentiles = 10
+stream_batch_rows = 1000  # Entries fetched from the cursor and written per chunk of a streamed collection
 
 collectionCreatedModel = api.model('CollectionCreatedModel', {
     'uri': fields.Url(description='The URL with which the imported collection can be retrieved'),
@@ -61,7 +93,8 @@ collectionWithDataModel = api.model('CollectionWithDataModel', {
         'country': fields.String(description="Country of the data entry"),
         'date': fields.Integer(description="Year of the data entry", min=2012),
         'value': fields.Float(description="Value of the data entry"),
-    })))
+    }))),
+    'next_cursor': fields.Integer(description="Only on full pages: the cursor of the next page"),
 })
 
 singleEconomicIndicatorValueModel = api.model('SingleEconomicIndicatorValueModel', {
@@ -70,6 +103,8 @@ singleEconomicIndicatorValueModel = api.model('SingleEconomicIndicatorValueModel
     'country': fields.String(description="Country of the data entry"),
     'year': fields.Integer(description="Year of the data entry", min=2012),
     'value': fields.Float(description="Value of the data entry"),
+    'rank': fields.Integer(description="Rank of the value within the year, 1 is the highest", min=1),
+    'percentile': fields.Float(description="Percentile of the rank, 100 is the highest and 0 the lowest value"),
 })
 
 topBottomModel = api.model('TopBottomModel', {
@@ -78,6 +113,63 @@ topBottomModel = api.model('TopBottomModel', {
     'entries': fields.List(fields.Nested(api.model('TopBottomDataEntryModel', {
         'country': fields.String(description="Country of the data entry"),
         'value': fields.Float(description="Value of the data entry"),
+        'rank': fields.Integer(description="Rank of the value within the year, only with q or a percentile band"),
+        'percentile': fields.Float(description="Percentile of the rank, only with a percentile band"),
+    })))
+})
+
+panelModel = api.model('PanelModel', {
+    'collections': fields.List(fields.Nested(api.model('PanelCollectionModel', {
+        'id': fields.Integer(description='The id of the collection', min=1),
+        'indicator': fields.String(description='The indicator from http://api.worldbank.org/v2/indicators'),
+        'indicator_value': fields.String(description='The indicator name'),
+    }))),
+    'entries': fields.List(fields.Nested(api.model('PanelEntryModel', {
+        'country': fields.String(description="Country of the data entry"),
+        'year': fields.Integer(description="Year of the data entry", min=2012),
+        'values': fields.List(fields.Float, description="Value of each collection, in the order of collections"),
+    })))
+})
+
+statsModel = api.model('StatsModel', {
+    'id': fields.Integer(description='The id of the collection', min=1),
+    'indicator': fields.String(description='The indicator from http://api.worldbank.org/v2/indicators'),
+    'indicator_value': fields.String(description='The indicator name'),
+    'entries': fields.List(fields.Nested(api.model('StatsEntryModel', {
+        'year': fields.Integer(description="Year of the statistics, only with group_by=year", min=2012),
+        'count': fields.Integer(description="Number of values, entries without a value are not counted"),
+        'min': fields.Float(description="Smallest value"),
+        'max': fields.Float(description="Largest value"),
+        'mean': fields.Float(description="Mean value"),
+        'median': fields.Float(description="Median value"),
+        'percentiles': fields.List(fields.Nested(api.model('PercentileModel', {
+            'percentile': fields.Float(description="Percentile between 0 and 100"),
+            'value': fields.Float(description="Value at the percentile, linearly interpolated"),
+        }))),
+    })))
+})
+
+importJobModel = api.model('ImportJobModel', {
+    'uri': fields.String(description='The URL with which the job can be polled'),
+    'id': fields.Integer(description='A unique integer identifier of the import job', min=1),
+    'indicator_id': fields.String(description='The indicator from http://api.worldbank.org/v2/indicators'),
+    'status': fields.String(description='queued, running, finished or failed'),
+    'pages_fetched': fields.Integer(description='Result pages downloaded from the source API so far'),
+    'pages_total': fields.Integer(description='Result pages of the indicator, known after the first page'),
+    'rows_stored': fields.Integer(description='Entries stored in the database'),
+    'collection_id': fields.Integer(description='The id of the imported collection once finished'),
+    'collection_uri': fields.String(description='The URL of the imported collection once finished'),
+    'error': fields.String(description='Error message of a failed import'),
+})
+
+batchImportModel = api.model('BatchImportModel', {
+    'entries': fields.List(fields.Nested(api.model('BatchImportEntryModel', {
+        'indicator_id': fields.String(description='The indicator from http://api.worldbank.org/v2/indicators'),
+        'status': fields.Integer(description='201 imported, 404 unknown indicator, 409 already imported or being '
+                                             'imported, 502 source API failed'),
+        'message': fields.String(description='Result of the import'),
+        'id': fields.Integer(description='The id of the imported or already existing collection'),
+        'uri': fields.String(description='The URL of the imported or already existing collection'),
     })))
 })
 
@@ -90,6 +182,16 @@ errorModel = api.model('ErrorModel', {
     'message': fields.String(description='Error message'),
 })
 
+cacheStatsModel = api.model('CacheStatsModel', {
+    'entries': fields.Integer(description='Number of cached collections'),
+    'bytes': fields.Integer(description='Serialized size of the cached collections'),
+    'max_entries': fields.Integer(description='Maximum number of cached collections'),
+    'max_bytes': fields.Integer(description='Maximum serialized size of the cached collections'),
+    'hits': fields.Integer(description='Requests served from the cache'),
+    'misses': fields.Integer(description='Requests that had to read the database'),
+    'evictions': fields.Integer(description='Collections dropped to stay within the limits'),
+})
+
 
 class DBService:
     # https://www.tutorialspoint.com/python_design_patterns/python_design_patterns_singleton.htm
@@ -125,24 +227,181 @@ class DBService:
                         indicator_name TEXT
                       )
                 ''')
+            # Covering indexes in the order of GET /collections sorted by these columns, with the id as tie breaker
+            connection.execute(''' CREATE INDEX IF NOT EXISTS ix_collections_creation_time
+                                    ON collections (creation_time, id, indicator_id) ''')
+            connection.execute(''' CREATE INDEX IF NOT EXISTS ix_collections_indicator_id
+                                    ON collections (indicator_id, id, creation_time) ''')
+            # Country dimension: every observation refers to its country by the integer key
+            connection.execute(''' CREATE TABLE IF NOT EXISTS countries (
+                        id INTEGER PRIMARY KEY,
+                        code TEXT UNIQUE,
+                        iso3code TEXT,
+                        name TEXT
+                      )
+                ''')
+            connection.execute("CREATE INDEX IF NOT EXISTS ix_countries_name ON countries (name)")
+            migrate_text_observations = self.rename_text_observations(connection)
+            # All collection data in one long table instead of one collection_<id> table per collection. The
+            # indicator is that of the collections row, the country that of the countries row
+            connection.execute(''' CREATE TABLE IF NOT EXISTS observations (
+                        collection_id INTEGER NOT NULL REFERENCES collections (id),
+                        country_key INTEGER NOT NULL REFERENCES countries (id),
+                        year INTEGER NOT NULL,
+                        value REAL,
+                        rank INTEGER
+                      )
+                ''')
+            # Collections stored before ranks were precomputed
+            add_rank_column = "rank" not in [row["name"] for row in
+                                             connection.execute("PRAGMA table_info(observations)")]
+            if add_rank_column:
+                connection.execute("ALTER TABLE observations ADD COLUMN rank INTEGER")
+            # Covering index: point lookups of value and rank by year and country never read the table itself.
+            # Replaces the index without rank of earlier versions
+            connection.execute("DROP INDEX IF EXISTS ix_observations_collection_year_country")
+            connection.execute(''' CREATE INDEX IF NOT EXISTS ix_observations_collection_year_country_rank
+                                    ON observations (collection_id, year, country_key, value, rank) ''')
+            # Covering index in value order: statistics read the values of a collection already sorted, panels
+            # read the values of some years
+            connection.execute(''' CREATE INDEX IF NOT EXISTS ix_observations_collection_year_value
+                                    ON observations (collection_id, year, value, country_key) ''')
+            # Entries of a collection in rowid (import) order: pages continue with a range probe on the rowid
+            connection.execute(''' CREATE INDEX IF NOT EXISTS ix_observations_collection
+                                    ON observations (collection_id) ''')
+            # Covering index in rank order: top/bottom N, rank and percentile bands of a year are rank range scans
+            connection.execute(''' CREATE INDEX IF NOT EXISTS ix_observations_collection_year_rank
+                                    ON observations (collection_id, year, rank, country_key, value) ''')
+            if migrate_text_observations:
+                self.insert_text_observations(connection, "observations_text")
+                connection.execute("DROP TABLE observations_text")
+            if migrate_text_observations or add_rank_column:
+                for row in connection.execute("SELECT id FROM collections").fetchall():
+                    self.rank_collection(connection, row["id"])
+        if migrate_text_observations:
+            # Give the space of the text columns back to the file system
+            with self.engine.connect() as connection:
+                connection.execute("VACUUM")
+        self.migrate_collection_tables()
+
+    @staticmethod
+    def rename_text_observations(connection):
+        """ Moves an observations table of earlier versions (date TEXT, country and indicator text on every row)
+        out of the way, so it can be copied into the current one. Returns whether there was one """
+        columns = [row["name"] for row in connection.execute("PRAGMA table_info(observations)")]
+        if "date" not in columns:
+            return False
+        print("DBService.rename_text_observations: converting observations to the typed schema")
+        for index_name in ["ix_observations_collection_date_country", "ix_observations_collection_date_country_value",
+                           "ix_observations_collection_date_value", "ix_observations_collection"]:
+            connection.execute("DROP INDEX IF EXISTS " + index_name)
+        connection.execute("ALTER TABLE observations RENAME TO observations_text")
+        return True
+
+    @staticmethod
+    def insert_text_observations(connection, table_name, collection_id=None):
+        """ Copies observations in the text columns of earlier versions from table_name, in their order. Tables
+        without a collection_id column (collection_<id>) need the collection_id """
+        collection_id_sql = "t.collection_id" if collection_id is None else str(int(collection_id))
+        connection.execute(''' INSERT OR IGNORE INTO countries (code, iso3code, name)
+                                SELECT country_id, countryiso3code, country_value
+                                FROM {}
+                                GROUP BY country_id'''.format(table_name))
+        # Non-annual dates would all be cast to their year and collide with it, leave them out like new imports do
+        skipped = connection.execute(''' SELECT count(*) FROM {}
+                                        WHERE date IS NULL OR date NOT GLOB '[0-9][0-9][0-9][0-9]'
+                                     '''.format(table_name)).scalar()
+        if skipped > 0:
+            print("DBService.insert_text_observations: " + table_name + " skipping " + str(skipped) +
+                  " entries with non-annual dates")
+        connection.execute(''' INSERT INTO observations (collection_id, country_key, year, value)
+                                SELECT {}, countries.id, CAST(t.date AS INTEGER), t.value
+                                FROM {} t JOIN countries ON countries.code = t.country_id
+                                WHERE t.date GLOB '[0-9][0-9][0-9][0-9]'
+                                ORDER BY t.rowid'''.format(collection_id_sql, table_name))
+
+    def migrate_collection_tables(self):
+        """ Moves the data of collection_<id> tables created by earlier versions into observations """
+        with self.engine.connect() as connection:
+            table_names = [row[0] for row in connection.execute(
+                "SELECT name FROM sqlite_master WHERE type = 'table' AND name LIKE 'collection\\_%' ESCAPE '\\'")]
+        for table_name in table_names:
+            collection_id = int(table_name[len("collection_"):])
+            print("DBService.migrate_collection_tables: " + table_name)
+            with self.engine.begin() as connection:
+                self.insert_text_observations(connection, table_name, collection_id)
+                self.rank_collection(connection, collection_id)
+                connection.execute("DROP TABLE " + table_name)
+
+    @staticmethod
+    def rank_collection(connection, collection_id):
+        """ Sets the rank column of the observations of a collection stored without ranks """
+        rows = connection.execute(''' SELECT rowid, year, value, country_key FROM observations
+                                        WHERE collection_id = ?''', (collection_id,)).fetchall()
+        ranks = DataTransUtils.year_ranks([(row["year"], row["value"], row["country_key"]) for row in rows])
+        updates = [(rank, row["rowid"]) for rank, row in zip(ranks, rows) if rank is not None]
+        if len(updates) > 0:
+            connection.execute("UPDATE observations SET rank = ? WHERE rowid = ?", updates)
 
     def store_collection(self, indicator_metadata, min_year, max_year, dataframe):
-        data = (indicator_metadata["id"], indicator_metadata["name"], min_year, max_year)
         with self.engine.begin() as connection:
-            connection.execute(''' INSERT INTO collections (indicator_id, indicator_name, min_year, max_year) 
-                                    VALUES(?,?,?,?)''', data)
-            result = connection.execute(''' SELECT id FROM collections 
-                                            WHERE indicator_id = ?''', (indicator_metadata["id"],))
-            collection_id = result.fetchone()[0]
-
-        newdf = dataframe.drop(columns=["indicator", "country"])
-        newdf["collections_id"] = collection_id
-        newdf.to_sql('collection_' + str(collection_id), con=self.engine, if_exists='replace')
-        # dtype={"indicator": str, "country": str, "countryiso3code": str, "date": int, "unit": str, "obs_status": str,
-        # "indicator_id": str, "indicator_value": str, "country_id": str, "country_value": str})
+            # Same transaction as the collections row, a failed import leaves nothing behind
+            collection_id = self.insert_collection(connection, indicator_metadata, min_year, max_year, dataframe)
         print("DBService.store_collection: Stored ID " + str(collection_id))
         return collection_id
 
+    def store_collections(self, imports):
+        """ Stores a batch of (indicator_metadata, dataframe or None if empty) in one transaction, returns the ids.
+        Indicators imported by someone else in the meantime are skipped, their id is None """
+        with self.engine.begin() as connection:
+            collection_ids = [self.insert_collection(connection, indicator_metadata, query_year_start,
+                                                     query_year_end, dataframe, ignore_existing=True)
+                              for indicator_metadata, dataframe in imports]
+        print("DBService.store_collections: Stored IDs " + str(collection_ids))
+        return collection_ids
+
+    @staticmethod
+    def insert_collection(connection, indicator_metadata, min_year, max_year, dataframe, ignore_existing=False):
+        """ Returns the id of the new collection. With ignore_existing, an indicator that is already stored is
+        left as it is and None returned instead of failing the transaction """
+        data = (indicator_metadata["id"], indicator_metadata["name"], min_year, max_year)
+        result = connection.execute(''' INSERT {} INTO collections (indicator_id, indicator_name, min_year, max_year)
+                                         VALUES(?,?,?,?)'''.format("OR IGNORE" if ignore_existing else ""), data)
+        if result.rowcount == 0:
+            return None
+        result = connection.execute(''' SELECT id FROM collections 
+                                        WHERE indicator_id = ?''', (indicator_metadata["id"],))
+        collection_id = result.fetchone()[0]
+
+        if dataframe is not None:
+            # Years only: quarterly or monthly dates (2013Q1, 2013M01) do not fit the integer year column
+            annual = dataframe["date"].astype(str).str.match(r"^\d{4}$")
+            if not annual.all():
+                print("DBService.insert_collection: " + indicator_metadata["id"] + " skipping " +
+                      str(int((~annual).sum())) + " entries with non-annual dates")
+                dataframe = dataframe[annual]
+            country_keys = DBService.insert_countries(connection, dataframe)
+            values = dataframe["value"].astype(float)
+            entries = [(int(date), None if pd.isna(value) else value, country_keys[country_id])
+                       for country_id, date, value in zip(dataframe["country_id"], dataframe["date"], values)]
+            # Ranked once here, so rank queries never sort
+            rows = [(collection_id, country_key, year, value, rank) for (year, value, country_key), rank
+                    in zip(entries, DataTransUtils.year_ranks(entries))]
+            if len(rows) > 0:
+                connection.execute(''' INSERT INTO observations (collection_id, country_key, year, value, rank)
+                                        VALUES(?,?,?,?,?)''', rows)
+        return collection_id
+
+    @staticmethod
+    def insert_countries(connection, dataframe):
+        """ Adds the countries of the dataframe that are new to the countries table, returns code -> key """
+        countries = dataframe.drop_duplicates("country_id")
+        connection.execute(''' INSERT OR IGNORE INTO countries (code, iso3code, name)
+                                VALUES(?,?,?)''', list(zip(countries["country_id"], countries["countryiso3code"],
+                                                        countries["country_value"])))
+        # A few hundred rows: cheaper to read all than to bind every code of the dataframe
+        return {row["code"]: row["id"] for row in connection.execute("SELECT id, code FROM countries")}
+
     def store_empty(self, indicator_metadata):
         data = (indicator_metadata["id"], indicator_metadata["name"], query_year_start, query_year_end)
         with self.engine.begin() as connection:
@@ -151,27 +410,13 @@ class DBService:
             result = connection.execute(''' SELECT id FROM collections 
                                             WHERE indicator_id = ?''', (indicator_metadata["id"],))
             collection_id = result.fetchone()[0]
-            empty_ddl = '''CREATE TABLE IF NOT EXISTS collection_{}(	
-                           "index" BIGINT,
-                           countryiso3code TEXT,
-                           date TEXT,
-                           value FLOAT,
-                           unit TEXT,
-                           obs_status TEXT,
-                           decimal BIGINT,
-                           indicator_id TEXT,
-                           indicator_value TEXT,
-                           country_id TEXT,
-                           country_value TEXT,
-                           collections_id BIGINT)'''.format(collection_id)
-            connection.execute(empty_ddl)
 
         print("DBService.store_collection: EMPTY DATASET. Stored ID " + str(collection_id))
         return collection_id
 
     def delete_collection_by_id(self, collection_id):
         with self.engine.begin() as connection:
-            connection.execute("DROP TABLE IF EXISTS collection_" + str(collection_id))
+            connection.execute("DELETE FROM observations WHERE collection_id = ?", (collection_id,))
             connection.execute("DELETE FROM collections WHERE id = ?", (collection_id,))
 
     def get_collection_by_indicator_id(self, indicator_id):
@@ -191,36 +436,220 @@ class DBService:
             return result.fetchone()
 
     def collection_data_exists(self, collection_id):
-        if self.engine.has_table("collection_" + str(collection_id)):
-            return True
-        return False
+        # Empty imports have no observations, the collection row is what counts
+        return self.get_collection_by_id(collection_id) is not None
+
+    def iter_collection_entries(self, collection_id, offset=None, limit=None, after=None):
+        """ Batches of (rowid, country, date, value) of a collection in import order, read from the cursor as
+        they are consumed. after skips to the entries behind a rowid of an earlier page """
+        query = '''
+                select o.rowid as rowid, c.name as country, o.year as date, o.value
+                from observations o join countries c on c.id = o.country_key
+                where o.collection_id = ?'''
+        params = [collection_id]
+        if after is not None:
+            query += " and o.rowid > ?"
+            params.append(after)
+        query += " order by o.rowid"
+        if offset is not None or limit is not None:
+            query += " limit ? offset ?"
+            params += [limit if limit is not None else -1, offset if offset is not None else 0]
+        with self.engine.connect() as connection:
+            result = connection.execute(query, tuple(params))
+            rows = result.fetchmany(stream_batch_rows)
+            while len(rows) > 0:
+                yield rows
+                rows = result.fetchmany(stream_batch_rows)
+
+    def get_collection_value(self, collection_id, year, country):
+        """ Value and rank of one country and year with the number of ranked observations of the year,
+        None if there is no observation """
+        # Country key first, so the lookup is a probe of the (collection_id, year, country_key) index. The
+        # lowest rank of the year is a single probe at the end of its range of the rank index
+        with self.engine.connect() as connection:
+            result = connection.execute('''
+                select value, rank,
+                    (select max(rank) from observations where collection_id = ? and year = ?) as ranked
+                from observations
+                where collection_id = ? and year = ?
+                    and country_key in (select id from countries where name = ?)''',
+                                        (collection_id, int(year), collection_id, int(year), country))
+            return result.fetchone()
 
-    def get_collection_data_df(self, collection_id):
+    def get_collection_year_entries(self, collection_id, year):
+        """ Country and value of all observations of a year, in import order """
         with self.engine.connect() as connection:
-            df = pd.read_sql_table(con=connection,
-                                   table_name="collection_" + str(collection_id))
-            return df
-
-    # {+id,-creation_time,-indicator}
-    def get_collections_with_order(self, order_text: str):
-        print("get_collections_with_order: " + order_text)
-        order_text = order_text.replace("{", "").replace("}", "")
-        order_values = order_text.split(",")
-        order_sql = " "
-        for value in order_values:
-            print("Value: " + value.strip())
-            if value.startswith(" "):
-                order_sql = order_sql + " " + value.strip() + " ASC"
-            if value.strip().startswith("-"):
-                order_sql = order_sql + " " + value.replace("-", "").strip() + " DESC"
-            order_sql = order_sql + ","
-        order_sql = order_sql[:-1]
+            return connection.execute('''
+                select c.name as country, o.value
+                from observations o join countries c on c.id = o.country_key
+                where o.collection_id = ? and o.year = ?
+                order by o.rowid''', (collection_id, int(year))).fetchall()
+
+    def get_collection_year_ranked(self, collection_id, year):
+        """ Number of ranked observations (those with a value) of a year, the lowest rank """
         with self.engine.connect() as connection:
             result = connection.execute('''
-                select id, creation_time, indicator_id 
-                from collections
-                order by {}'''.format(order_sql))
-            return result.fetchall()
+                select max(rank) as ranked
+                from observations
+                where collection_id = ? and year = ?''', (collection_id, int(year)))
+            return result.fetchone()["ranked"] or 0
+
+    def get_collection_year_rank_range(self, collection_id, year, rank_min, rank_max, ascending=True):
+        """ Country, value and rank of the observations of a year ranked rank_min to rank_max, in rank order
+        (ascending=False: from rank_max down) """
+        with self.engine.connect() as connection:
+            return connection.execute('''
+                select c.name as country, o.value, o.rank
+                from observations o join countries c on c.id = o.country_key
+                where o.collection_id = ? and o.year = ? and o.rank between ? and ?
+                order by o.rank {}'''.format("asc" if ascending else "desc"),
+                                      (collection_id, int(year), rank_min, rank_max)).fetchall()
+
+    def get_panel(self, collection_ids, year_start=None, year_end=None, countries=None):
+        """ One row per country and year with the value of each collection in value_0, value_1, ... (None where
+        a collection has no observation), optionally within a year range and for some countries only """
+        columns = ", ".join("max(case when o.collection_id = ? then o.value end) as value_{}".format(i)
+                            for i in range(len(collection_ids)))
+        query = '''
+                select c.name as country, o.year, {}
+                from observations o join countries c on c.id = o.country_key
+                where o.collection_id in ({})'''.format(columns, ",".join("?" * len(collection_ids)))
+        params = list(collection_ids) + list(collection_ids)
+        if year_start is not None:
+            query += " and o.year >= ?"
+            params.append(year_start)
+        if year_end is not None:
+            query += " and o.year <= ?"
+            params.append(year_end)
+        if countries:
+            query += " and c.name in ({})".format(",".join("?" * len(countries)))
+            params += countries
+        query += " group by o.country_key, o.year order by c.name, o.year"
+        with self.engine.connect() as connection:
+            return connection.execute(query, tuple(params)).fetchall()
+
+    def get_collection_values_df(self, collection_id):
+        """ Year and value of all observations with a value, sorted by year and value """
+        with self.engine.connect() as connection:
+            return pd.read_sql_query('''
+                select year, value
+                from observations
+                where collection_id = ? and value is not null
+                order by year, value''', con=connection, params=[collection_id])
+
+    def collection_year_exists(self, collection_id, year):
+        with self.engine.connect() as connection:
+            result = connection.execute('''
+                select 1
+                from observations
+                where collection_id = ? and year = ?
+                limit 1''', (collection_id, int(year)))
+            return result.fetchone() is not None
+
+    def get_collections_with_order(self, order, limit=None, after=None):
+        """ Collections sorted by order, a list of (column, descending) from parse_order_by. after: the values
+        of the order columns of the last collection of the previous page, only collections behind it """
+        query = "select id, creation_time, indicator_id from collections"
+        params = []
+        if after is not None:
+            # Keyset condition: (a > ?) or (a = ? and b > ?) or ..., with < for descending columns. The leading
+            # a >= ? is redundant, but lets SQLite seek into the index instead of scanning up to the cursor
+            first_column, first_descending = order[0]
+            terms = []
+            params.append(after[0])
+            for i, (column, descending) in enumerate(order):
+                conditions = [equal_column + " = ?" for equal_column, _ in order[:i]]
+                conditions.append(column + (" < ?" if descending else " > ?"))
+                terms.append("(" + " and ".join(conditions) + ")")
+                params += list(after[:i + 1])
+            query += " where {} {} ? and ({})".format(first_column, "<=" if first_descending else ">=",
+                                                        " or ".join(terms))
+        query += " order by " + ", ".join(column + (" desc" if descending else " asc") for column, descending in order)
+        if limit is not None:
+            query += " limit ?"
+            params.append(limit)
+        # Only whitelisted column names are part of the text, all values are bound
+        with self.engine.connect() as connection:
+            return connection.execute(query, tuple(params)).fetchall()
+
+
+class ResponseCache:
+    """ Thread safe LRU cache of response payloads, bounded by number of entries and serialized size. Keys belong
+    to a group (the key itself by default), invalidating a group removes all of its keys """
+
+    def __init__(self, max_entries, max_bytes, group=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.group = group if group is not None else (lambda key: key)
+        self.entries = OrderedDict()  # key -> (payload, size)
+        self.generations = {}  # group -> number of invalidations
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            if key not in self.entries:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return self.entries[key][0]
+
+    def generation(self, key):
+        """ Taken before reading the data of a miss and passed to put """
+        with self.lock:
+            return self.generations.get(self.group(key), 0)
+
+    def put(self, key, payload, generation=None):
+        size = len(json.dumps(payload))
+        with self.lock:
+            # Invalidated while the payload was read (e.g. deleted): it may already be outdated
+            if generation is not None and generation != self.generations.get(self.group(key), 0):
+                return
+            self._remove(key)
+            if size > self.max_bytes:
+                return
+            self.entries[key] = (payload, size)
+            self.bytes += size
+            while len(self.entries) > self.max_entries or self.bytes > self.max_bytes:
+                self._remove(next(iter(self.entries)))
+                self.evictions += 1
+
+    def invalidate(self, group):
+        with self.lock:
+            self.generations[group] = self.generations.get(group, 0) + 1
+            for key in [key for key in self.entries if self.group(key) == group]:
+                self._remove(key)
+
+    def _remove(self, key):
+        if key in self.entries:
+            self.bytes -= self.entries.pop(key)[1]
+
+    def stats(self):
+        with self.lock:
+            return {
+                "entries": len(self.entries),
+                "bytes": self.bytes,
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions
+            }
+
+
+# Collections are immutable after the import, only deletion (and the reuse of a deleted id) invalidates them
+collection_cache = ResponseCache(response_cache_max_entries, response_cache_max_bytes)
+# Keyed by (collection id, group_by, percentiles), grouped by the collection id
+stats_cache = ResponseCache(stats_cache_max_entries, response_cache_max_bytes, group=lambda key: key[0])
+
+
+def invalidate_collection_caches(collection_id):
+    collection_cache.invalidate(collection_id)
+    stats_cache.invalidate(collection_id)
 
 
 class DataTransUtils:
@@ -240,56 +669,336 @@ class DataTransUtils:
             lambda x: DataTransUtils.extract_field_from_json(x, "value"))
         return param_df
 
+    @staticmethod
+    def value_stats(values, percentiles):
+        """ count, min, max, mean, median and percentiles of a sorted numpy array of values """
+        return {
+            "count": len(values),
+            "min": float(values[0]),
+            "max": float(values[-1]),
+            "mean": float(values.mean()),
+            "median": float(np.median(values)),
+            "percentiles": [{"percentile": percentile, "value": float(value)}
+                            for percentile, value in zip(percentiles, np.percentile(values, percentiles))]
+        }
+
+    @staticmethod
+    def year_ranks(entries):
+        """ Rank of each (year, value, country_key) within its year, 1 for the highest value. Ties are ranked by
+        country_key, entries without a value get None """
+        ranks = [None] * len(entries)
+        year = None
+        rank = 0
+        for i in sorted((i for i, entry in enumerate(entries) if entry[1] is not None),
+                        key=lambda i: (entries[i][0], -entries[i][1], entries[i][2])):
+            if entries[i][0] != year:
+                year = entries[i][0]
+                rank = 0
+            rank += 1
+            ranks[i] = rank
+        return ranks
+
+    @staticmethod
+    def rank_percentile(rank, ranked):
+        """ Percentile of a rank among ranked entries: 100 for the highest value, 0 for the lowest """
+        return 100.0 if ranked <= 1 else 100.0 * (ranked - rank) / (ranked - 1)
+
+    @staticmethod
+    def collection_entry(row):
+        return {"country": row["country"], "date": row["date"], "value": row["value"]}
+
+    @staticmethod
+    def stream_collection(header, batches, limit=None):
+        """ Writes the collection JSON chunk by chunk: header fields, then the entries of each batch as they
+        come from the cursor, then the cursor of the next page """
+        yield json.dumps(header)[:-1] + ', "entries": ['
+        count = 0
+        last_rowid = None
+        for rows in batches:
+            yield ("," if count > 0 else "") + ",".join(
+                json.dumps(DataTransUtils.collection_entry(row)) for row in rows)
+            count += len(rows)
+            last_rowid = rows[-1]["rowid"]
+        if limit is not None and count == limit:
+            yield '], "next_cursor": {}}}'.format(last_rowid)
+        else:
+            yield "]}"
+
+
+class TokenBucket:
+    """ Thread safe token bucket: acquire() blocks until one of burst tokens, refilled at rate per second, is free """
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.last_refill = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.last_refill) * self.rate)
+                self.last_refill = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait_seconds = (1 - self.tokens) / self.rate
+            time.sleep(wait_seconds)
+
+
+# Shared by all imports, so parallel imports together stay within the rate limit
+api_rate_limiter = TokenBucket(api_requests_per_second, api_request_burst)
+
+
+class HTTPSession:
+    """ Small keep-alive HTTP client: idle connections are pooled per host and reused, responses may be gzipped """
+
+    def __init__(self, max_connections_per_host, timeout, keep_alive=True, max_redirects=5):
+        self.max_connections_per_host = max_connections_per_host
+        self.timeout = timeout
+        self.keep_alive = keep_alive
+        self.max_redirects = max_redirects
+        self.pools = {}  # (scheme, host) -> LIFO queue of idle connections
+        self.lock = threading.Lock()
+
+    def get(self, url):
+        """ Returns the decoded response body """
+        return self.fetch(url)[2]
+
+    def fetch(self, url, headers=None, redirects=0):
+        """ Returns status, headers and decoded body of the response. Redirects are followed, 200 and 304 are
+        returned, any other status raises HTTPError """
+        parts = urlsplit(url)
+        key = (parts.scheme, parts.netloc)
+        path = parts.path + ("?" + parts.query if parts.query else "")
+        with self.lock:
+            pool = self.pools.setdefault(key, queue.LifoQueue(maxsize=self.max_connections_per_host))
+
+        try:
+            connection = pool.get_nowait()
+            reused = True
+        except queue.Empty:
+            connection = self.connect(key)
+            reused = False
+        try:
+            response, body = self.request(connection, path, headers)
+        except (http.client.HTTPException, OSError):
+            connection.close()
+            if not reused:
+                raise
+            # The server may have closed the idle connection in the meantime, retry once on a new one
+            connection = self.connect(key)
+            response, body = self.request(connection, path, headers)
+
+        if self.keep_alive and not response.will_close:
+            try:
+                pool.put_nowait(connection)
+            except queue.Full:
+                connection.close()
+        else:
+            connection.close()
+
+        if response.status in (301, 302, 303, 307, 308) and response.getheader("Location"):
+            if redirects >= self.max_redirects:
+                raise HTTPError(url, response.status, "Too many redirects", response.headers, None)
+            # A new host (e.g. http -> https) gets its own pool
+            return self.fetch(urljoin(url, response.getheader("Location")), headers, redirects + 1)
+        if response.status not in (200, 304):
+            # Nothing else is a response body the cache may store
+            raise HTTPError(url, response.status, response.reason, response.headers, None)
+        if response.getheader("Content-Encoding") == "gzip":
+            body = gzip.decompress(body)
+        return response.status, response.headers, body
+
+    def connect(self, key):
+        scheme, netloc = key
+        if scheme == "https":
+            return http.client.HTTPSConnection(netloc, timeout=self.timeout)
+        return http.client.HTTPConnection(netloc, timeout=self.timeout)
+
+    def request(self, connection, path, headers=None):
+        request_headers = {
+            "Accept-Encoding": "gzip",
+            "Connection": "keep-alive" if self.keep_alive else "close"
+        }
+        request_headers.update(headers or {})
+        connection.request("GET", path, headers=request_headers)
+        response = connection.getresponse()
+        # The body has to be read completely before the connection can be used again
+        return response, response.read()
+
+
+# One connection per concurrently fetched page is enough
+api_session = HTTPSession(api_max_concurrent_pages, api_timeout_seconds)
+
+
+class APICache:
+    """ On-disk cache of source API responses. Each URL is stored as <sha256 of url>.json (body) and
+    <sha256 of url>.meta.json (url, store time, ETag, Last-Modified) in api_cache_dir """
+
+    @staticmethod
+    def get(url, rate_limited=False):
+        """ Response body of the url, from the cache while fresh, else from the source API """
+        if not api_cache_enabled:
+            return APICache.download(url, rate_limited)[2]
+
+        meta, body = APICache.load(url)
+        if meta is not None and (api_cache_offline or time.time() - meta["stored_at"] < api_cache_ttl_seconds):
+            return body
+        if api_cache_offline:
+            raise IOError("Offline and no cached response for " + url)
+
+        headers = {}
+        if meta is not None and meta.get("etag"):
+            headers["If-None-Match"] = meta["etag"]
+        if meta is not None and meta.get("last_modified"):
+            headers["If-Modified-Since"] = meta["last_modified"]
+        try:
+            status, response_headers, response_body = APICache.download(url, rate_limited, headers)
+        except (HTTPError, http.client.HTTPException, OSError):
+            if meta is None:
+                raise
+            # Source API unreachable: an outdated answer is better than none
+            print("APICache.get: serving stale response for " + url)
+            return body
+
+        if status == 304:
+            # Still valid, only restart its TTL
+            APICache.store(url, body, meta.get("etag"), meta.get("last_modified"))
+            return body
+        APICache.store(url, response_body, response_headers.get("ETag"), response_headers.get("Last-Modified"))
+        return response_body
+
+    @staticmethod
+    def download(url, rate_limited, headers=None):
+        if rate_limited:
+            api_rate_limiter.acquire()
+        return api_session.fetch(url, headers)
+
+    @staticmethod
+    def path(url):
+        return os.path.join(api_cache_dir, hashlib.sha256(url.encode("utf-8")).hexdigest())
+
+    @staticmethod
+    def load(url):
+        try:
+            with open(APICache.path(url) + ".meta.json") as f:
+                meta = json.load(f)
+            with open(APICache.path(url) + ".json", "rb") as f:
+                return meta, f.read()
+        except (IOError, ValueError):
+            return None, None
+
+    @staticmethod
+    def store(url, body, etag=None, last_modified=None):
+        os.makedirs(api_cache_dir, exist_ok=True)
+        meta = {"url": url, "stored_at": time.time(), "etag": etag, "last_modified": last_modified}
+        # Write to temporary files and rename, so parallel requests never read half written entries
+        for suffix, content in ((".json", body), (".meta.json", json.dumps(meta).encode("utf-8"))):
+            temp_path = APICache.path(url) + suffix + "." + str(threading.get_ident())
+            with open(temp_path, "wb") as f:
+                f.write(content)
+            os.replace(temp_path, APICache.path(url) + suffix)
+
+    @staticmethod
+    def seed(indicator_json):
+        """ Stores a saved API response ([metadata, entries]) as the responses to the metadata and page
+        requests of an import of its indicator, so it can be imported offline. Only complete responses
+        (a single page holding all entries) are seeded, a partial one would be served as the whole indicator """
+        with open(indicator_json) as f:
+            response_metadata, records = json.load(f)
+        if int(response_metadata.get("pages", 1)) > 1 or int(response_metadata.get("total", 0)) > len(records):
+            print("APICache.seed: skipping " + indicator_json + ", holds page " + str(response_metadata.get("page")) +
+                  " of " + str(response_metadata.get("pages")) + " only")
+            return
+        if len(records) == 0:
+            print("APICache.seed: skipping " + indicator_json + ", holds no entries")
+            return
+        indicator = records[0]["indicator"]
+        APICache.store(APIService.indicator_url(indicator["id"]), json.dumps(
+            [{"page": 1, "pages": 1, "per_page": 50, "total": 1},
+             [{"id": indicator["id"], "name": indicator["value"]}]]).encode("utf-8"))
+
+        query_url = APIService.query_url(indicator["id"], query_year_start, query_year_end)
+        pages = max(1, int(math.ceil(len(records) / api_page_size)))
+        for page_no in range(1, pages + 1):
+            page_records = records[(page_no - 1) * api_page_size:page_no * api_page_size]
+            APICache.store(APIService.page(query_url, page_no), json.dumps(
+                [{"page": page_no, "pages": pages, "per_page": api_page_size, "total": len(records)},
+                 page_records]).encode("utf-8"))
+        print("APICache.seed: " + indicator["id"] + " from " + indicator_json)
+
 
 class APIService:
     # http://api.worldbank.org/v2/countries/all/indicators/NY.GDP.MKTP.CD?date=2012:2017&format=json&per_page=1000
 
     latest_metadata = None
 
+    @staticmethod
+    def get_json(url, rate_limited=False):
+        return json.loads(APICache.get(url, rate_limited))
+
+    @staticmethod
+    def indicator_url(indicator):
+        return api_base_url + "/indicator/{}?format=json".format(indicator)
+
+    @staticmethod
+    def query_url(indicator, date_start, date_end):
+        query_url = api_base_url + "/countries/all/indicators/" + indicator + "?"
+        query_url = APIService.per_page(query_url, api_page_size)
+        query_url = APIService.date_range(query_url, date_start, date_end)
+        return APIService.json(query_url)
+
     @staticmethod
     def indicator_exists(indicator):
-        url = "http://api.worldbank.org/v2/indicator/{}?format=json".format(indicator)
-        json_url = urlopen(url)
-        result: json = json.loads(json_url.read())
-        md = result.pop(0)
-        if "message" in md:
-            return False
-        return True
+        return APIService.get_indicator_metadata(indicator) is not None
 
     @staticmethod
     def get_indicator_metadata(indicator):
-        url = "http://api.worldbank.org/v2/indicator/{}?format=json".format(indicator)
-        json_url = urlopen(url)
-        result: json = json.loads(json_url.read())
+        """ Metadata of the indicator, None if the source API does not know it """
+        result = APIService.get_json(APIService.indicator_url(indicator))
+        if "message" in result[0]:
+            return None
         return result[1][0]
 
-    def get_all_by_indicator_and_date(self, indicator, date_start, date_end):
-        query_url = api_base_url + "/countries/all/indicators/" + indicator + "?per_page=10000"
-        query_url = self.date_range(query_url, date_start, date_end)
-        query_url = self.json(query_url)
+    @staticmethod
+    def get_page(query_url, page_no):
+        """ Returns metadata and data of one result page """
+        page_url = APIService.page(query_url, page_no)
+        print("APIService.get_page: page_url=" + page_url)
+        result = APIService.get_json(page_url, rate_limited=True)
+        return result[0], result[1] if len(result) > 1 else None
+
+    def get_all_by_indicator_and_date(self, indicator, date_start, date_end, progress=None):
+        """ All entries of the indicator, None if there are none. progress(pages_fetched, pages_total) is
+        called after every page """
+        query_url = self.query_url(indicator, date_start, date_end)
 
         print("APIService.get_all_by_indicator_and_date: query_url=" + query_url)
 
-        json_url = urlopen(query_url, timeout=30)
-        result = json.loads(json_url.read())
-        self.latest_metadata = result.pop(0)
-
-        print("APIService.get_all_by_indicator_and_date: "
-              "Current Page= " + str(self.latest_metadata["page"]) + " from= " + str(self.latest_metadata["pages"]))
-
-        while int(self.latest_metadata["page"]) < int(self.latest_metadata["pages"]):
-            next_page_no = int(self.latest_metadata["page"]) + 1
-            next_page_url = self.page(query_url, next_page_no)
-            print("APIService.get_all_by_indicator_and_date: next_page_url=" + next_page_url)
-            json_url = urlopen(self.page(query_url, next_page_no))
-            temp_result = json.loads(json_url.read())
-            self.latest_metadata = temp_result.pop(0)
-            temp_result_data = temp_result.pop(0)
-            result[0].extend(temp_result_data)
-            print("APIService.get_all_by_indicator_and_date: sleep=" + next_page_url)
-            time.sleep(api_sleep_seconds)
-
-        return result.pop(0)
+        # The first page tells how many pages there are, the others are independent of each other
+        self.latest_metadata, data = self.get_page(query_url, 1)
+        pages = int(self.latest_metadata["pages"])
+        print("APIService.get_all_by_indicator_and_date: pages=" + str(pages))
+        if progress is not None:
+            progress(1, pages)
+        if data is None:
+            return None
+
+        if pages > 1:
+            with ThreadPoolExecutor(max_workers=api_max_concurrent_pages) as executor:
+                # map returns the pages in page order, whatever order they arrive in
+                for page_metadata, page_data in executor.map(lambda page_no: self.get_page(query_url, page_no),
+                                                             range(2, pages + 1)):
+                    self.latest_metadata = page_metadata
+                    if page_data is not None:
+                        data.extend(page_data)
+                    if progress is not None:
+                        progress(int(page_metadata["page"]), pages)
+
+        return data
 
     @staticmethod
     def date_range(query, date_start, date_end):
@@ -309,6 +1018,270 @@ class APIService:
         return query + ("" if query[-1] == "?" else "&") + "page=" + str(page)
 
 
+class ImportJob:
+    """ State of one background import, updated by the worker and read by GET /jobs/<id> """
+
+    def __init__(self, job_id, indicator_id, indicator_metadata):
+        self.id = job_id
+        self.indicator_id = indicator_id
+        self.indicator_metadata = indicator_metadata
+        self.status = "queued"
+        self.pages_fetched = 0
+        self.pages_total = None
+        self.rows_stored = 0
+        self.collection_id = None
+        self.error = None
+        self.done = threading.Event()  # Set once finished or failed
+
+    def page_fetched(self, pages_fetched, pages_total):
+        self.pages_fetched = pages_fetched
+        self.pages_total = pages_total
+
+    def to_dict(self):
+        return {
+            "uri": "/jobs/" + str(self.id),
+            "id": self.id,
+            "indicator_id": self.indicator_id,
+            "status": self.status,
+            "pages_fetched": self.pages_fetched,
+            "pages_total": self.pages_total,
+            "rows_stored": self.rows_stored,
+            "collection_id": self.collection_id,
+            "collection_uri": None if self.collection_id is None else "/collections/" + str(self.collection_id),
+            "error": self.error
+        }
+
+
+class ImportService:
+    # Jobs live in memory only, they are lost on restart (the imported collections are not)
+    jobs = {}
+    active_jobs = {}  # indicator_id -> queued or running job, so concurrent imports of it coalesce
+    lock = threading.Lock()
+    executor = ThreadPoolExecutor(max_workers=import_max_workers)
+
+    @staticmethod
+    def import_collection(indicator_id, indicator_metadata, job=None):
+        """ Downloads and stores the indicator, returns the collection id """
+        ext_api: APIService = APIService()
+        db: DBService = DBService.get_instance()
+
+        api_result = ext_api.get_all_by_indicator_and_date(indicator_id, query_year_start, query_year_end,
+                                                           progress=None if job is None else job.page_fetched)
+
+        if api_result is None:
+            stored_id = db.store_empty(indicator_metadata)
+        else:
+            df = pd.DataFrame(api_result)
+            df = DataTransUtils.flatten_collections_df(df)
+            stored_id = db.store_collection(indicator_metadata, query_year_start, query_year_end, df)
+            if job is not None:
+                job.rows_stored = len(df)
+        # SQLite may hand out the id of a deleted collection again
+        invalidate_collection_caches(stored_id)
+        return stored_id
+
+    @staticmethod
+    def download(indicator_id):
+        """ Returns the metadata (None if the indicator does not exist) and the flattened entries (None if empty) """
+        indicator_metadata = APIService.get_indicator_metadata(indicator_id)
+        if indicator_metadata is None:
+            return None, None
+        api_result = APIService().get_all_by_indicator_and_date(indicator_id, query_year_start, query_year_end)
+        if api_result is None:
+            return indicator_metadata, None
+        return indicator_metadata, DataTransUtils.flatten_collections_df(pd.DataFrame(api_result))
+
+    @staticmethod
+    def import_batch(indicator_ids):
+        """ Downloads the indicators in parallel and stores all new ones in one transaction.
+        Returns a status entry per indicator """
+        db: DBService = DBService.get_instance()
+        entries = {}
+        batch_jobs = {}
+        for indicator_id in indicator_ids:
+            result = db.get_collection_by_indicator_id(indicator_id)
+            if result is not None:
+                entries[indicator_id] = {"status": 409, "id": result["id"],
+                                         "message": "Indicator {} already exists in collections".format(indicator_id)}
+                continue
+            # Active until stored, so other imports of the indicator coalesce with the batch instead of racing it
+            job, created = ImportService.register(indicator_id, None)
+            if not created:
+                entries[indicator_id] = {"status": 409,
+                                         "message": "Indicator {} is being imported by /jobs/{}".format(
+                                             indicator_id, job.id)}
+                continue
+            job.status = "running"
+            batch_jobs[indicator_id] = job
+
+        try:
+            ImportService.download_and_store_batch(list(batch_jobs), entries)
+        finally:
+            for indicator_id, job in batch_jobs.items():
+                entry = entries.get(indicator_id, {"status": 500, "message": "Batch import failed"})
+                if entry["status"] == 201:
+                    job.collection_id = entry["id"]
+                    job.status = "finished"
+                else:
+                    job.error = entry["message"]
+                    job.status = "failed"
+                ImportService.release(job)
+
+        output = []
+        for indicator_id in indicator_ids:
+            entry = {"indicator_id": indicator_id, "id": None, "uri": None}
+            entry.update(entries[indicator_id])
+            if entry["id"] is not None:
+                entry["uri"] = "/collections/" + str(entry["id"])
+            output.append(entry)
+        return output
+
+    @staticmethod
+    def download_and_store_batch(to_download, entries):
+        """ Downloads the indicators in parallel, stores them in one transaction and adds their entries """
+        db: DBService = DBService.get_instance()
+        imports = []
+        with ThreadPoolExecutor(max_workers=batch_max_concurrent_indicators) as executor:
+            futures = [(indicator_id, executor.submit(ImportService.download, indicator_id))
+                       for indicator_id in to_download]
+            for indicator_id, future in futures:
+                try:
+                    indicator_metadata, df = future.result()
+                except Exception as e:
+                    print("ImportService.download_and_store_batch: " + indicator_id + " failed: " + str(e))
+                    entries[indicator_id] = {"status": 502, "message": "Source API failed: " + str(e)}
+                    continue
+                if indicator_metadata is None:
+                    entries[indicator_id] = {"status": 404,
+                                             "message": "Indicator {} does not exist in source API".format(
+                                                 indicator_id)}
+                    continue
+                imports.append((indicator_id, indicator_metadata, df))
+
+        if len(imports) > 0:
+            collection_ids = db.store_collections([(indicator_metadata, df) for _, indicator_metadata, df in imports])
+            for (indicator_id, _, _), collection_id in zip(imports, collection_ids):
+                if collection_id is None:
+                    # Imported elsewhere since the check above, the other indicators are stored anyway
+                    result = db.get_collection_by_indicator_id(indicator_id)
+                    entries[indicator_id] = {"status": 409, "id": None if result is None else result["id"],
+                                             "message": "Indicator {} already exists in collections".format(
+                                                 indicator_id)}
+                    continue
+                invalidate_collection_caches(collection_id)
+                entries[indicator_id] = {"status": 201, "id": collection_id,
+                                         "message": "Indicator {} imported".format(indicator_id)}
+
+    @staticmethod
+    def register(indicator_id, indicator_metadata):
+        """ Returns a new active job for the indicator and True, or the job already importing it and False """
+        with ImportService.lock:
+            job = ImportService.active_jobs.get(indicator_id)
+            if job is not None:
+                return job, False
+            job = ImportJob(len(ImportService.jobs) + 1, indicator_id, indicator_metadata)
+            ImportService.jobs[job.id] = job
+            ImportService.active_jobs[indicator_id] = job
+            return job, True
+
+    @staticmethod
+    def submit(indicator_id, indicator_metadata):
+        """ Queues an import of the indicator, or returns the job already importing it """
+        job, created = ImportService.register(indicator_id, indicator_metadata)
+        if created:
+            ImportService.executor.submit(ImportService.run, job)
+        return job
+
+    @staticmethod
+    def import_now(indicator_id, indicator_metadata):
+        """ Imports the indicator in the calling thread, or waits for the job already importing it.
+        Returns the finished or failed job """
+        job, created = ImportService.register(indicator_id, indicator_metadata)
+        if created:
+            ImportService.run(job)
+        else:
+            job.done.wait()
+        return job
+
+    @staticmethod
+    def run(job):
+        job.status = "running"
+        try:
+            job.collection_id = ImportService.import_collection(job.indicator_id, job.indicator_metadata, job)
+            job.status = "finished"
+        except Exception as e:
+            print("ImportService.run: job " + str(job.id) + " failed: " + str(e))
+            job.error = str(e)
+            job.status = "failed"
+        finally:
+            ImportService.release(job)
+
+    @staticmethod
+    def release(job):
+        """ Ends the job as active import of its indicator and wakes up those waiting for it """
+        with ImportService.lock:
+            ImportService.active_jobs.pop(job.indicator_id, None)
+        job.done.set()
+
+    @staticmethod
+    def get_job(job_id):
+        with ImportService.lock:
+            return ImportService.jobs.get(job_id)
+
+
+def non_negative_int_arg(name, minimum=0):
+    """ Integer query parameter, None if not given. Aborts with 400 if it is no integer or below minimum """
+    value = request.args.get(name)
+    if value is None or value == "":
+        return None
+    if not re.match(r"^\d{1,18}$", value.strip()) or int(value) < minimum:
+        api.abort(400, "Parameter {} invalid: {} - must be an integer of at least {}".format(name, value, minimum))
+    return int(value)
+
+
+def parse_order_by(order_text):
+    """ Compiles order_by like {+id,-creation_time} into a list of (column, descending) of whitelisted columns,
+    ending with id so the order is unique. Raises ValueError with the reason if it is invalid """
+    # An unencoded + arrives as a space
+    values = order_text.replace("{", "").replace("}", "").split(",")
+    if len(values) > 3:
+        raise ValueError("order_by expects only a maximum of 3 attributes")
+    order = []
+    for value in values:
+        if not (value.startswith(" ") or value.startswith("+") or value.startswith("-")):
+            raise ValueError("order_by value {} must have a prefix + or -".format(value))
+        column = value[1:].strip()
+        if column not in collection_order_columns:
+            raise ValueError("order_by can't handle value:{} (only: {})".format(
+                value, ",".join(collection_order_columns)))
+        if column in [ordered_column for ordered_column, _ in order]:
+            raise ValueError("order_by value {} is given twice".format(column))
+        order.append((column, value.startswith("-")))
+    if "id" not in [column for column, _ in order]:
+        # In the direction of the last column: a uniform direction is read from the index in either direction
+        order.append(("id", order[-1][1]))
+    return order
+
+
+def encode_collections_cursor(order, row):
+    """ Opaque after= token: the order and the values of its columns of the last collection of a page """
+    cursor = {"order": order, "after": [row[column] for column, _ in order]}
+    return base64.urlsafe_b64encode(json.dumps(cursor).encode("utf-8")).decode("ascii")
+
+
+def decode_collections_cursor(order, token):
+    """ Values to continue behind, raises ValueError if the token is invalid or from another order """
+    try:
+        cursor = json.loads(base64.urlsafe_b64decode(token.encode("ascii")).decode("utf-8"))
+        cursor_order = [(column, descending) for column, descending in cursor["order"]]
+        after = cursor["after"]
+    except (ValueError, TypeError, KeyError):
+        raise ValueError("after is not a cursor of this service")
+    if cursor_order != order or len(after) != len(order):
+        raise ValueError("after belongs to another order_by")
+    return after
+
+
 @api.route('/collections')
 class Collections(Resource):
 
@@ -323,33 +1296,38 @@ class Collections(Resource):
                          " internal data format and store it in the database."
                          "Usage underlies the Terms and Conditions of the Worldbank Group:"
                          "https://www.worldbank.org/en/about/legal/terms-and-conditions")
+    @api.response(202, "Import accepted, poll the job URI for its progress", importJobModel)
     @api.param("indicator_id", description="An Indicator to import. Must be from"
                                            " http://api.worldbank.org/v2/indicators", type='string')
+    @api.param("async", description="true: return 202 with a job URI right away and import in the background."
+                                    " Concurrent imports of the same indicator share one job", type='boolean')
     def post(self):
         indicator_id = request.args.get("indicator_id")
         if indicator_id is None or indicator_id == "":
             api.abort(400, "Parameter indicator_id is mandatory")
-        if not APIService.indicator_exists(indicator_id):
+        # Fetched once per import, it answers both whether the indicator exists and what it is called
+        api_indicator_metadata = APIService.get_indicator_metadata(indicator_id)
+        if api_indicator_metadata is None:
             api.abort(404, "Indicator {} does not exist in source API".format(indicator_id))
 
-        ext_api: APIService = APIService()
         db: DBService = DBService.get_instance()
 
         result = db.get_collection_by_indicator_id(indicator_id)
         if result is not None:
             api.abort(409, "Indicator {} already exists in collections".format(indicator_id))
 
-        api_indicator_metadata = ext_api.get_indicator_metadata(indicator_id)
-        api_result = ext_api.get_all_by_indicator_and_date(indicator_id, query_year_start, query_year_end)
+        if request.args.get("async", "").lower() == "true":
+            job = ImportService.submit(indicator_id, api_indicator_metadata)
+            return job.to_dict(), 202, {"Location": "/jobs/" + str(job.id)}
 
-        if api_result is None:
-            stored_id = db.store_empty(api_indicator_metadata)
-        else:
-            df = pd.DataFrame(api_result)
-            df = DataTransUtils.flatten_collections_df(df)
-            stored_id = db.store_collection(api_indicator_metadata, query_year_start, query_year_end, df)
-
-        result = db.get_collection_by_id(stored_id)
+        # Shares the job of a running import of the same indicator instead of inserting it a second time
+        job = ImportService.import_now(indicator_id, api_indicator_metadata)
+        if job.status != "finished":
+            # Lost the race against an import that was not yet active at the check above
+            if db.get_collection_by_indicator_id(indicator_id) is not None:
+                api.abort(409, "Indicator {} already exists in collections".format(indicator_id))
+            api.abort(500, "Import of indicator {} failed: {}".format(indicator_id, job.error))
+        result = db.get_collection_by_id(job.collection_id)
 
         return {
             "uri": "/collections/" + str(result["id"]),
@@ -369,26 +1347,25 @@ class Collections(Resource):
                                        "should be sorted, and it consists of two parts (+ or -,"
                                        " and the name of column e.g., id). In each segment, + "
                                        "indicates ascending order, and - indicates descending order", type='string')
+    @api.param("limit", description="Maximum number of collections. If there are more, the Link header "
+                                    "points to the next page", type='integer')
+    @api.param("after", description="Cursor of the next page, taken from the Link header of the previous page",
+               type='string')
     def get(self):
         order_by: str = request.args.get("order_by")
-        order_by_flag = False
-        if order_by is not None and order_by != "":
-            # if not order_by.startswith("{") or not order_by.endswith("}"):
-            #    api.abort(400, "order_by must be in curly brackets")
-            if len(order_by.split(",")) > 3:
-                api.abort(400, "order_by expects only a maximum of 3 attributes")
-            order_list = order_by.replace("{", "").replace("}", "").split(",")
-            for value in order_list:
-                if not (value.startswith(" ") or value.startswith("-")):
-                    api.abort(400, "order_by value {} must have a prefix + or -".format(value))
-                if value.replace("+", "").replace("-", "").strip() not in ["id", "indicator_id", "creation_time"]:
-                    api.abort(400, "order_by can't handle value:{} (only: id,creation_time,indicator_id)".format(value))
-            order_by_flag = True
+        try:
+            order = parse_order_by(order_by if order_by is not None and order_by != "" else "+id")
+            after = request.args.get("after")
+            after = decode_collections_cursor(order, after) if after is not None and after != "" else None
+        except ValueError as e:
+            api.abort(400, str(e))
+        limit = non_negative_int_arg("limit", 1)
+        if limit is not None and limit > collections_max_page_size:
+            api.abort(400, "limit must not be above {}".format(collections_max_page_size))
 
         db: DBService = DBService.get_instance()
 
-        result = db.get_collections_with_order(
-            request.args.get("order_by")) if order_by_flag else db.get_collections_with_order(" id")
+        result = db.get_collections_with_order(order, limit, after)
         output = []
         for row in result:
             output.append(
@@ -398,7 +1375,90 @@ class Collections(Resource):
                     "creation_time": str(row["creation_time"]),
                     "indicator_id": str(row["indicator_id"])
                 })
-        return output
+        if limit is None or len(result) < limit:
+            return output
+
+        next_args = dict(request.args.items())
+        next_args["after"] = encode_collections_cursor(order, result[-1])
+        return output, 200, {"Link": '</collections?{}>; rel="next"'.format(urlencode(next_args))}
+
+
+@api.route('/collections/batch')
+class CollectionsBatch(Resource):
+
+    @api.response(200, "Batch processed, see the status of each indicator", batchImportModel)
+    @api.response(400, "Parameter indicator_ids is mandatory", errorModel)
+    @api.doc(description="Imports several indicators in one call. The indicators are downloaded in parallel "
+                         "and all new collections are stored in a single transaction. Indicators that do not "
+                         "exist or are already imported are reported per indicator and do not fail the batch.")
+    @api.param("indicator_ids", description="Comma separated list of indicators to import. Must be from"
+                                            " http://api.worldbank.org/v2/indicators", type='string')
+    def post(self):
+        indicator_ids_text = request.args.get("indicator_ids", "")
+        indicator_ids = []
+        for indicator_id in indicator_ids_text.split(","):
+            if indicator_id.strip() != "" and indicator_id.strip() not in indicator_ids:
+                indicator_ids.append(indicator_id.strip())
+        if len(indicator_ids) == 0:
+            api.abort(400, "Parameter indicator_ids is mandatory")
+        if len(indicator_ids) > batch_max_indicators:
+            api.abort(400, "indicator_ids expects a maximum of {} indicators".format(batch_max_indicators))
+
+        return {"entries": ImportService.import_batch(indicator_ids)}
+
+
+@api.route('/collections/panel')
+class CollectionsPanel(Resource):
+
+    @api.response(200, "Successfully retrieved the panel", panelModel)
+    @api.response(400, "Parameter ids is mandatory", errorModel)
+    @api.response(404, "Collection id {} not found.", errorModel)
+    @api.doc(description="Values of several collections side by side, one entry per country and year. "
+                         "Computed by a single query instead of downloading and joining every collection.")
+    @api.param("ids", description="Comma separated list of collection ids", type='string')
+    @api.param("start_year", description="First year of the panel", type='integer')
+    @api.param("end_year", description="Last year of the panel", type='integer')
+    @api.param("country", description="Only this country, repeat the parameter for several countries",
+               type='string')
+    def get(self):
+        collection_ids = []
+        for collection_id in request.args.get("ids", "").split(","):
+            if collection_id.strip() == "":
+                continue
+            if not collection_id.strip().isdigit():
+                api.abort(400, "Parameter ids invalid: {} - must be a collection id".format(collection_id))
+            if int(collection_id) not in collection_ids:
+                collection_ids.append(int(collection_id))
+        if len(collection_ids) == 0:
+            api.abort(400, "Parameter ids is mandatory")
+        if len(collection_ids) > panel_max_collections:
+            api.abort(400, "ids expects a maximum of {} collections".format(panel_max_collections))
+        year_start = non_negative_int_arg("start_year")
+        year_end = non_negative_int_arg("end_year")
+        countries = [country for country in request.args.getlist("country") if country != ""]
+
+        db: DBService = DBService.get_instance()
+
+        collections = []
+        for collection_id in collection_ids:
+            result_md = db.get_collection_by_id(collection_id)
+            if result_md is None:
+                api.abort(404, "Collection with id {} not found.".format(collection_id))
+            collections.append({
+                "id": collection_id,
+                "indicator": result_md["indicator_id"],
+                "indicator_value": result_md["indicator_name"]
+            })
+
+        result = db.get_panel(collection_ids, year_start, year_end, countries)
+        return {
+            "collections": collections,
+            "entries": [{
+                "country": row["country"],
+                "year": row["year"],
+                "values": [row["value_{}".format(i)] for i in range(len(collection_ids))]
+            } for row in result]
+        }
 
 
 @api.route('/collections/<int:id>')
@@ -416,6 +1476,7 @@ class CollectionsByID(Resource):
             api.abort(404, "Collection id {} does not exist".format(id))
 
         db.delete_collection_by_id(id)
+        invalidate_collection_caches(id)
         return {
             "message": "The collection {} was removed from the database!".format(id),
             "id": id
@@ -424,33 +1485,114 @@ class CollectionsByID(Resource):
     # Question 4 - Retrieve a collection
     @api.response(200, "Successfully retrieved collection", collectionWithDataModel)
     @api.response(404, "Collection with id {} not found.", errorModel)
+    @api.response(400, "offset, limit or cursor invalid", errorModel)
     @api.doc(description="This operation retrieves a collection by its ID . "
                          "The response of this operation will show the imported "
                          "content from world bank API for all 6 years.")
+    @api.param("stream", description="true: write the entries to the response while they are read from the "
+                                     "database, for large collections", type='boolean')
+    @api.param("limit", description="Maximum number of entries. Full pages include a next_cursor", type='integer')
+    @api.param("offset", description="Number of entries to skip", type='integer')
+    @api.param("cursor", description="next_cursor of the previous page: continue behind its last entry",
+               type='integer')
     def get(self, id):
+        limit = non_negative_int_arg("limit", 1)
+        offset = non_negative_int_arg("offset")
+        cursor = non_negative_int_arg("cursor")
+        stream = request.args.get("stream", "").lower() == "true"
+        # Only the complete collection is cached
+        whole_collection = limit is None and offset is None and cursor is None
+
+        if whole_collection and not stream:
+            payload = collection_cache.get(id)
+            if payload is not None:
+                return payload
+            cache_generation = collection_cache.generation(id)
+
         db: DBService = DBService.get_instance()
 
         if not db.collection_data_exists(id):
             api.abort(404, "Collection with id {} not found.".format(id))
 
         result_md = db.get_collection_by_id(id)
-        result_df = db.get_collection_data_df(id)
+        header = {
+            "id": id,
+            "indicator": result_md["indicator_id"],
+            "indicator_value": result_md["indicator_name"],
+            "creation_time": result_md["creation_time"]
+        }
+        batches = db.iter_collection_entries(id, offset, limit, cursor)
 
-        indicator = result_md["indicator_id"]
-        indicator_value = result_md["indicator_name"]
+        if stream:
+            return Response(DataTransUtils.stream_collection(header, batches, limit), mimetype="application/json")
 
-        result_df = result_df.rename(columns={"country_value": "country"})
-        result_df = result_df.filter(["country", "date", "value"])
+        entries = []
+        last_rowid = None
+        for rows in batches:
+            entries += [DataTransUtils.collection_entry(row) for row in rows]
+            last_rowid = rows[-1]["rowid"]
 
-        entries = json.loads(result_df.to_json(orient='records'))
+        payload = dict(header, entries=entries)
+        if limit is not None and len(entries) == limit:
+            payload["next_cursor"] = last_rowid
+        if whole_collection:
+            collection_cache.put(id, payload, cache_generation)
+        return payload
 
-        return {
+
+@api.route('/collections/<int:id>/stats')
+@api.param("id", description="The unique integer identifier automatically generated for an imported collection")
+class CollectionStats(Resource):
+
+    @api.response(200, "Successfully computed the statistics", statsModel)
+    @api.response(400, "group_by or percentiles invalid", errorModel)
+    @api.response(404, "Collection with id {} not found.", errorModel)
+    @api.doc(description="Minimum, maximum, mean, median and percentiles of the values of a collection, "
+                         "over all years or per year. Entries without a value are ignored.")
+    @api.param("group_by", description="year: one entry per year instead of one over all years", type='string')
+    @api.param("percentiles", description="Comma separated percentiles between 0 and 100, default 25,75",
+               type='string')
+    def get(self, id):
+        group_by = request.args.get("group_by", "")
+        if group_by not in ["", "year"]:
+            api.abort(400, "Parameter group_by invalid: {} - only year is supported".format(group_by))
+        percentiles = []
+        for percentile in request.args.get("percentiles", "25,75").split(","):
+            if not re.match(r"^\d{1,3}(\.\d+)?$", percentile.strip()) or float(percentile) > 100:
+                api.abort(400, "Parameter percentiles invalid: {} - must be between 0 and 100".format(percentile))
+            percentiles.append(float(percentile))
+        if len(percentiles) > stats_max_percentiles:
+            api.abort(400, "percentiles expects a maximum of {} values".format(stats_max_percentiles))
+
+        cache_key = (id, group_by, tuple(percentiles))
+        payload = stats_cache.get(cache_key)
+        if payload is not None:
+            return payload
+        cache_generation = stats_cache.generation(cache_key)
+
+        db: DBService = DBService.get_instance()
+
+        result_md = db.get_collection_by_id(id)
+        if result_md is None:
+            api.abort(404, "Collection with id {} not found.".format(id))
+
+        values_df = db.get_collection_values_df(id)
+        entries = []
+        if group_by == "year":
+            for year, year_df in values_df.groupby("year"):
+                entries.append(dict(year=int(year), **DataTransUtils.value_stats(year_df["value"].to_numpy(),
+                                                                                  percentiles)))
+        elif len(values_df) > 0:
+            entries.append(DataTransUtils.value_stats(np.sort(values_df["value"].to_numpy()), percentiles))
+
+        payload = {
             "id": id,
-            "indicator": indicator,
-            "indicator_value": indicator_value,
-            "creation_time": result_md["creation_time"],
+            "indicator": result_md["indicator_id"],
+            "indicator_value": result_md["indicator_name"],
             "entries": entries
         }
+        stats_cache.put(cache_key, payload, cache_generation)
+        return payload
 
 
 @api.route('/collections/<int:id>/<int:year>/<string:country>')
@@ -467,31 +1609,26 @@ class CollectionsByIDAndYearAndCountry(Resource):
     def get(self, id, year, country):
         db: DBService = DBService.get_instance()
 
-        if not db.collection_data_exists(id):
+        result_md = db.get_collection_by_id(id)
+        if result_md is None:
             api.abort(404, "Collection with id {} not found.".format(id))
 
-        result_df = db.get_collection_data_df(id)
-        result_df = result_df.rename(columns={
-            "country_value": "country",
-            "indicator_id": "indicator",
-            "collections_id": "id",
-            "date": "year"
-        })
-        result_df = result_df.filter(["id", "indicator", "country", "year", "value"])
-        result_df = result_df[result_df["year"] == str(year)]
-        if not result_df["id"].count() >= 1:
-            api.abort(404, "Could not find data for year: {}".format(year))
-
-        result_df = result_df[result_df["country"] == country]
-        if not result_df["id"].count() >= 1:
+        result = db.get_collection_value(id, year, country)
+        if result is None:
+            # Only on a miss: tell the client which part of the lookup failed
+            if not db.collection_year_exists(id, year):
+                api.abort(404, "Could not find data for year: {}".format(year))
             api.abort(404, "Could not find data for country: {}".format(country))
 
         return {
             "id": id,
-            "indicator": result_df["indicator"].max(),
-            "country": result_df["country"].max(),
+            "indicator": result_md["indicator_id"],
+            "country": country,
             "year": year,
-            "value": result_df["value"].max()
+            "value": result["value"],
+            "rank": result["rank"],
+            "percentile": None if result["rank"] is None else DataTransUtils.rank_percentile(result["rank"],
+                                                                                           result["ranked"])
         }
 
 
@@ -511,6 +1648,10 @@ class CollectionsByIDAndYear(Resource):
                            "-N : Returns bottom N countries sorted by indicator value "
                            " where N can be an integer value between 1 and 100",
                type='string')
+    @api.param("percentile_min", description="Only countries at or above this percentile (0 is the lowest value)",
+               type='number')
+    @api.param("percentile_max", description="Only countries at or below this percentile (100 is the highest value)",
+               type='number')
     def get(self, id, year):
         query: str = request.args.get("q")
         pattern = re.compile("^[+-]{0,1}\d{1,3}$")
@@ -525,6 +1666,13 @@ class CollectionsByIDAndYear(Resource):
             if query_number <= 0 or query_number > 100:
                 api.abort(400, "Query parameter invalid: {} - must be between 1 and 100".format(query))
             query_flag = True
+        percentile_band = [self.percentile_arg(name, default) for name, default in
+                           (("percentile_min", 0.0), ("percentile_max", 100.0))]
+        band_flag = "percentile_min" in request.args or "percentile_max" in request.args
+        if band_flag and query_flag:
+            api.abort(400, "q and a percentile band can't be combined")
+        if percentile_band[0] > percentile_band[1]:
+            api.abort(400, "percentile_min must not be above percentile_max")
 
         db: DBService = DBService.get_instance()
 
@@ -532,21 +1680,32 @@ class CollectionsByIDAndYear(Resource):
             api.abort(404, "Collection with id {} not found.".format(id))
 
         result_md = db.get_collection_by_id(id)
-        result_df = db.get_collection_data_df(id)
 
         indicator = result_md["indicator_id"]
         indicator_value = result_md["indicator_name"]
 
-        result_df = result_df.rename(columns={"country_value": "country"})
-        result_df = result_df[result_df["date"] == str(year)]
-        result_df = result_df.filter(["country", "value"])
+        if query_flag or band_flag:
+            ranked = db.get_collection_year_ranked(id, year)
+        if query_flag and bottom_flag:
+            # Lowest value first
+            result = db.get_collection_year_rank_range(id, year, ranked - query_number + 1, ranked, ascending=False)
+        elif query_flag:
+            result = db.get_collection_year_rank_range(id, year, 1, query_number)
+        elif band_flag:
+            # percentile = 100 * (ranked - rank) / (ranked - 1), solved for the ranks inside the band
+            rank_min = ranked - int(math.floor(percentile_band[1] * (ranked - 1) / 100))
+            rank_max = ranked - int(math.ceil(percentile_band[0] * (ranked - 1) / 100))
+            result = db.get_collection_year_rank_range(id, year, rank_min, rank_max)
+        else:
+            result = db.get_collection_year_entries(id, year)
 
-        entries = []
-        if query_flag:
-            entries = json.loads(
-                result_df.sort_values("value", ascending=bottom_flag).head(query_number).to_json(orient='records'))
+        if band_flag:
+            entries = [{"country": row["country"], "value": row["value"], "rank": row["rank"],
+                        "percentile": DataTransUtils.rank_percentile(row["rank"], ranked)} for row in result]
+        elif query_flag:
+            entries = [{"country": row["country"], "value": row["value"], "rank": row["rank"]} for row in result]
         else:
-            entries = json.loads(result_df.to_json(orient='records'))
+            entries = [{"country": row["country"], "value": row["value"]} for row in result]
 
         return {
             "indicator": indicator,
@@ -554,6 +1713,39 @@ class CollectionsByIDAndYear(Resource):
             "entries": entries
         }
 
+    @staticmethod
+    def percentile_arg(name, default):
+        value = request.args.get(name, "").strip()
+        if value == "":
+            return default
+        if not re.match(r"^\d{1,3}(\.\d+)?$", value) or float(value) > 100:
+            api.abort(400, "Parameter {} invalid: {} - must be between 0 and 100".format(name, value))
+        return float(value)
+
+
+@api.route('/jobs/<int:id>')
+@api.param("id", description="The unique integer identifier of an import job")
+class Jobs(Resource):
+
+    @api.response(200, "Successfully retrieved the import job", importJobModel)
+    @api.response(404, "Job with id {} not found.", errorModel)
+    @api.doc(description="Progress of a background import started with POST /collections?async=true. "
+                         "Once finished, collection_id and collection_uri point to the imported collection.")
+    def get(self, id):
+        job = ImportService.get_job(id)
+        if job is None:
+            api.abort(404, "Job with id {} not found.".format(id))
+        return job.to_dict()
+
+
+@api.route('/cache/collections')
+class CollectionCacheStats(Resource):
+
+    @api.response(200, "Successfully retrieved the collection cache statistics", cacheStatsModel)
+    @api.doc(description="Hit/miss counters and size of the in-process cache of GET /collections/<id> responses")
+    def get(self):
+        return collection_cache.stats()
+
 
 @app.errorhandler(404)
 def resource_not_found(e):
@@ -575,4 +1767,6 @@ if __name__ == '__main__':
     print("!!! MAKE SURE YOU DOWNGRADE werkzeug TO VERSION 0.16.1 AT LAST !!!")
     print("GitHub Issue: https://github.com/noirbizarre/flask-restplus/issues/777")
 
+    for seed_file in api_cache_seed_files:
+        APICache.seed(seed_file)
     app.run(debug=True)